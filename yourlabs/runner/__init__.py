@@ -1,48 +1,427 @@
+import atexit
+import collections
 import datetime
 import logging
-import time
 import traceback
 import signal
 import sys
 import datetime
 import os
 import os.path
+import threading
+import Queue
 
 from django.core.management import call_command
 from django.conf import settings
-from django.core.mail import send_mail
-from django.utils.importlib import import_module
 
+import backoff
 import daemon
+import db
+import history
+import isolation
+import lease
+import loader
+import metrics
+import notify
+import profiling
+import scheduler
+import state
+import timeout
+from timeout import TaskTimeout
+
+# retry delay of tasks which could not be imported or run
+LOAD_RETRY = datetime.timedelta(minutes=1)
+
+# next run of tasks which wait for their upstream tasks
+PARKED = datetime.datetime.max
 
 class TaskRunner(daemon.Daemon):
     def __init__(self, task_names, pidfile=None, logger='runner', 
-                 allow_concurrent=False):
-        self.functions = []
-
-        names = []
-        for task_name in task_names:
-            s = task_name.split('.')
-            function = s[-1]
-            module = '.'.join(s[:-1])
-            module = import_module(module)
-            function = getattr(module, function)
-            
-            if not hasattr(function, 'runner_task'):
-                function = task()(function)
-            self.functions.append(function)
-            names.append(function.__name__)
+                 allow_concurrent=False, workers=1, metrics_file=None,
+                 metrics_port=None, state_backend=None, leases=None,
+                 reload=False, task_options=None):
+        self.workers = workers
+        self.metrics_file = metrics_file
+        self.metrics_port = metrics_port
+        self.metrics_server = None
+        self.reload = reload
+        self.task_options = task_options
+        # serializes updates of the dependency graph
+        self.graph_lock = threading.RLock()
+
+        # functions are imported when first due, see loader.TaskRef
+        self.refs = [loader.TaskRef(name, reload, task_options)
+                     for name in task_names]
 
         if pidfile is None:
-            pidfile = os.path.join(settings.RUN_ROOT, '_'.join(names))
+            pidfile = os.path.join(settings.RUN_ROOT,
+                                   '_'.join([ref.name for ref in self.refs]))
 
         super(TaskRunner, self).__init__(pidfile, logger, allow_concurrent)
+        self.scheduler = scheduler.Scheduler()
         self.concurrency_security()
+        # isolated workers would hold the lock after the runner died
+        isolation.keep_private(self.pidfile_fd)
+
+        if state_backend is None:
+            state_backend = state.get_backend()
+        self.state_backend = state_backend
+
+        if leases is True:
+            leases = lease.LeaseManager(len(self.refs))
+        self.leases = leases
+
+    @property
+    def tasks(self):
+        """
+        Tasks which were loaded so far.
+        """
+        return [ref.task for ref in self.refs if ref.task is not None]
+
+    def start(self):
+        """
+        Start the lease heartbeat and the metrics server if enabled.
+        """
+        if self.leases is not None:
+            self.leases.start()
+            atexit.register(self.leases.stop)
+            self.log('debug', 'Running as node %s', self.leases.node)
+
+        if self.metrics_port:
+            self.metrics_server = metrics.serve(self.metrics_port,
+                                                lambda: self.tasks)
+            self.log('debug', 'Serving metrics on port %s', self.metrics_port)
+
+    def stop(self):
+        """
+        Stop the threads started by start() and those of the notifiers, so
+        that they don't die in the teardown of the interpreter.
+        """
+        if self.leases is not None:
+            self.leases.stop()
+
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server = None
+
+        for notifier in set([task.notifier for task in self.tasks]):
+            notifier.stop()
 
     def run(self):
+        self.start()
+
+        for ref in self.refs:
+            self.schedule(ref)
+
+        if self.workers > 1:
+            self.run_workers()
+        else:
+            while True:
+                ref = self.scheduler.pop()
+                if ref is None:
+                    break
+                self.run_safely(ref)
+
+        self.disarm()
+        self.stop()
+        self.log('debug', 'Drained, exiting')
+
+    def drain(self):
+        super(TaskRunner, self).drain()
+        self.scheduler.stop()
+
+    def schedule(self, ref, when=None):
+        self.scheduler.schedule(ref, when)
+
+    def wake(self, ref):
+        """
+        Run the task of ref as soon as possible, from any thread.
+        """
+        self.scheduler.wake(ref)
+
+    def triggered(self, ref):
+        """
+        Wake ref up, unless its task is failing: then it waits for its fail
+        cooldown.
+        """
+        if ref.task is None or ref.task.downsince is None:
+            self.wake(ref)
+
+    def load(self, ref):
+        """
+        Return the task of ref, loading or reloading it first and arming its
+        triggers. If it can't be loaded or it should not run now, reschedule
+        ref and return None.
+        """
+        now = datetime.datetime.now()
+        first = ref.task is None
+
+        try:
+            task = ref.load(self.state_backend)
+            self.link(ref)
+        except Exception:
+            self.log('error', 'Could not load %s:\n%s', ref.path,
+                     traceback.format_exc())
+            self.schedule(ref, now + LOAD_RETRY)
+            return None
+
+        self.arm(ref)
+
+        if first and ref.upstreams:
+            with self.graph_lock:
+                ready = all(upstream.succeeded()
+                            for upstream in ref.upstreams)
+            if not ready:
+                self.log('debug', 'Waiting for the tasks %s depends on',
+                         ref.name)
+                self.schedule(ref, PARKED)
+                return None
+        elif first and task.next_run is not None and task.next_run > now:
+            # schedule restored from a previous runner
+            self.schedule(ref, task.next_run)
+            return None
+
+        return task
+
+    def get_ref(self, path):
+        """
+        Return the ref of the task at path, adding it to the runner if
+        necessary.
+        """
+        for ref in self.refs:
+            if ref.path == path:
+                return ref
+
+        ref = loader.TaskRef(path, self.reload, self.task_options)
+        self.refs.append(ref)
+        if self.leases is not None:
+            # the fair share must count it
+            self.leases.task_count = len(self.refs)
+        self.schedule(ref)
+        self.log('debug', 'Added %s, a dependency', path)
+        return ref
+
+    def link(self, ref):
+        """
+        Connect ref to the refs of the tasks it depends on. Raise ValueError
+        if that makes a cycle.
+        """
+        depends = ref.task.options['depends']
+        if depends is ref.depends:
+            return
+
+        with self.graph_lock:
+            upstreams = []
+            for path in depends:
+                if callable(path):
+                    path = '%s.%s' % (path.__module__, path.__name__)
+                upstreams.append(self.get_ref(path))
+
+            def check(upstream, chain):
+                chain = chain + [upstream.name]
+                if upstream is ref:
+                    raise ValueError('Circular dependency: %s' %
+                                     ' -> '.join(chain))
+                for parent in upstream.upstreams or ():
+                    check(parent, chain)
+
+            for upstream in upstreams:
+                check(upstream, [ref.name])
+
+            for upstream in ref.upstreams or ():
+                upstream.downstreams.remove(ref)
+            for upstream in upstreams:
+                upstream.downstreams.append(ref)
+            ref.upstreams = upstreams
+            ref.depends = depends
+            ref.satisfied.clear()
+
+    def propagate(self, ref):
+        """
+        After a run of the task of ref, wake up the downstream tasks which
+        have all their upstream tasks succeeded, or skip them if it failed.
+        """
+        success = ref.task.downsince is None
+
+        with self.graph_lock:
+            for downstream in ref.downstreams:
+                if not success:
+                    self.log('debug', 'Skipping %s, %s failed',
+                             downstream.name, ref.name)
+                    downstream.satisfied.discard(ref)
+                    continue
+
+                downstream.satisfied.add(ref)
+                if len(downstream.satisfied) == len(downstream.upstreams):
+                    downstream.satisfied.clear()
+                    self.wake(downstream)
+
+    def next_run(self, ref):
+        """
+        Return when to run the task of ref again: downstream tasks which
+        succeeded wait for their upstream tasks.
+        """
+        if ref.upstreams and ref.task.downsince is None:
+            return PARKED
+        return ref.task.next_run
+
+    def arm(self, ref):
+        """
+        Start the triggers of the task of ref, stopping those of its previous
+        version if it was reloaded.
+        """
+        triggers = ref.task.options['triggers']
+        if triggers is ref.triggers:
+            return
+
+        for trigger in ref.triggers:
+            trigger.stop()
+        ref.triggers = triggers
+
+        for trigger in triggers:
+            try:
+                trigger.start(ref.task, lambda: self.triggered(ref))
+            except Exception:
+                self.log('error', 'Could not start trigger %r of %s:\n%s',
+                         trigger, ref.path, traceback.format_exc())
+
+    def disarm(self):
+        for ref in self.refs:
+            for trigger in ref.triggers:
+                trigger.stop()
+
+    def prepare(self, ref):
+        """
+        Return the task of ref if it should run now, otherwise reschedule ref
+        and return None.
+        """
+        task = self.load(ref)
+        if task is None:
+            return None
+
+        if self.leases is not None and not self.acquire(task):
+            self.schedule(ref,
+                datetime.datetime.now() + self.leases.ttl / 3)
+            return None
+
+        return task
+
+    def run_task(self, ref):
+        task = self.prepare(ref)
+        if task is None:
+            return
+
+        try:
+            task.run()
+        finally:
+            self.schedule(ref, self.next_run(ref))
+            self.ran(task)
+            self.propagate(ref)
+            self.idle()
+
+    def run_safely(self, ref):
+        """
+        Run the task of ref, logging errors of the runner itself, like a
+        state or metrics file which can't be written, and rescheduling ref
+        anyway so that the task is not lost.
+        """
+        try:
+            self.run_task(ref)
+        except Exception:
+            self.log('error', 'Error while running %s:\n%s', ref.path,
+                     traceback.format_exc())
+            self.schedule(ref, self.retry(ref))
+
+    def retry(self, ref):
+        """
+        Return when to run the task of ref again after an error of the
+        runner: at its next run, but not before LOAD_RETRY.
+        """
+        retry = datetime.datetime.now() + LOAD_RETRY
+        when = None
+        if ref.task is not None:
+            when = self.next_run(ref)
+        if when is None or when < retry:
+            # the error may have happened before the cooldown was set
+            when = retry
+        return when
+
+    def ran(self, task):
+        """
+        Save the state and metrics of a task after a run, and tell the lease
+        manager that it is done.
+        """
+        try:
+            task.save_state(self.state_backend)
+
+            if self.metrics_file:
+                metrics.write(self.metrics_file, self.tasks)
+        finally:
+            if self.leases is not None:
+                self.leases.done(task.path)
+
+    def idle(self):
+        """
+        Close the database connections of the current thread if no task is
+        due within settings.RUNNER_DB_IDLE_CLOSE seconds (default: 60).
+        """
+        idle_close = getattr(settings, 'RUNNER_DB_IDLE_CLOSE', 60)
+        if idle_close is None:
+            return
+
+        when = self.scheduler.next_run()
+        if when is None or scheduler.total_seconds(
+                when - datetime.datetime.now()) > idle_close:
+            db.close_all()
+
+    def acquire(self, task):
+        try:
+            return self.leases.acquire(task.path)
+        except Exception:
+            # don't risk running the task on two nodes
+            self.log('error', 'Could not acquire the lease of %s', task.path)
+            return False
+
+    def run_workers(self):
+        """
+        Run tasks in a pool of worker threads: the main thread hands due
+        tasks over to the workers, which reschedule them once they ran.
+        """
+        queue = Queue.Queue()
+
+        def worker():
+            while True:
+                ref = queue.get()
+                if ref is None:
+                    return
+                if not self.draining:
+                    self.run_safely(ref)
+
+        # not capped by the number of refs, depends may add some
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=worker,
+                                      name='runner-worker-%s' % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        self.log('debug', 'Started %s workers', len(threads))
+
         while True:
-            for function in self.functions:
-                function.runner_task.run()
+            ref = self.scheduler.pop()
+            if ref is None:
+                break
+            # load in the main thread, which alone can install signal
+            # handlers for triggers
+            if ref.task is None and self.load(ref) is None:
+                continue
+            queue.put(ref)
+
+        # let workers finish their current task
+        for thread in threads:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
 
 def task(**options):
     def wrapper(f):
@@ -60,6 +439,9 @@ class Task(object):
     def __init__(self, function, **options):
         self.function = function
         self.name = self.function.__name__
+        # key of the state and lease, the name may be taken by tasks of
+        # other modules
+        self.path = '%s.%s' % (function.__module__, self.name)
 
         self.options = {
             'success_cooldown': datetime.timedelta(minutes=5),
@@ -68,13 +450,79 @@ class Task(object):
             'logger_name': 'runner',
             'uid': None,
             'gid': None,
+            'isolate': False,
+            'nice': None,
+            'rlimits': {},
+            'max_runs': None,
+            'max_rss': None,
+            'timeout': None,
+            'max_exceptions': 100,
+            'max_occurrences': 100,
+            'notifier': None,
+            'backoff': None,
+            'profile_every': None,
+            'profile_slower_than': None,
+            'profile_keep': 20,
+            'triggers': (),
+            'depends': (),
         }
+
+        self.next_run = None
+        self.last_cooldown = None
+        self.consecutive_failures = 0
+        self.worker = None
+        self.state_backend = None
+        self.configure(**options)
+
+        self.history = history.ExceptionHistory(
+            self.options['max_exceptions'], self.options['max_occurrences'])
+        # start of the current downtime, None if the last run succeeded
+        self.downsince = None
+        # fingerprints of distinct exceptions raised since downsince
+        self.consecutive = collections.OrderedDict()
+        self.admin_emails = collections.deque(
+            maxlen=self.options['max_occurrences'])
+        self.metrics = metrics.TaskMetrics()
+
+    def configure(self, **options):
+        """
+        Update options, for example with those of the command line.
+        """
         self.options.update(options)
 
-        self.exceptions = []
-        self.consecutive_exceptions = []
+        for option in ('success_cooldown', 'fail_cooldown',
+                       'non_recoverable_downtime'):
+            if not isinstance(self.options[option], datetime.timedelta):
+                # allow a number of seconds
+                self.options[option] = datetime.timedelta(
+                    seconds=self.options[option])
+
+        for option in ('timeout', 'profile_slower_than'):
+            if isinstance(self.options[option], datetime.timedelta):
+                self.options[option] = scheduler.total_seconds(
+                    self.options[option])
+
+        self.backoff = backoff.get_backoff(self.options['backoff'])
+        if self.worker is not None:
+            self.worker.stop()
+        self.worker = None
+        if self.options['isolate']:
+            self.worker = isolation.IsolatedWorker(self)
         self.logger = logging.getLogger(self.options['logger_name'])
-        self.admin_emails = []
+        self.notifier = self.options['notifier'] or notify.get_notifier()
+
+        self.profiler = None
+        if self.options['profile_every'] or \
+                self.options['profile_slower_than']:
+            self.profiler = profiling.Profiler(self)
+
+    def replace(self, other):
+        """
+        Run the function of task other with its options from now on, keeping
+        the state and schedule of this task.
+        """
+        self.function = other.function
+        self.configure(**other.options)
 
     def log(self, level, message, *args):
         if self.logger is None:
@@ -91,7 +539,10 @@ class Task(object):
     def run(self):
         try:
             started = datetime.datetime.now()
-            self.function()
+            if self.profiler is None:
+                self.call()
+            else:
+                self.profiler.call()
             ended = datetime.datetime.now()
             self.success(started, ended)
         except Exception as e:
@@ -99,34 +550,46 @@ class Task(object):
             exc_type, exc_value, exc_tb = sys.exc_info()
             self.fail(started, ended, exc_type, exc_value, exc_tb)
 
+    def call(self):
+        if self.worker is not None:
+            # the worker manages its own database connections
+            self.worker.run(self.options['timeout'])
+            return
+
+        with db.managed():
+            if self.options['timeout'] and timeout.can_alarm():
+                with timeout.alarm(self.options['timeout']):
+                    self.function()
+            else:
+                if self.options['timeout']:
+                    self.log('warning', 'Timeout needs option isolate when '
+                             'running in a worker thread')
+                self.function()
+
     def success(self, started, ended):
         self.log('debug', 'Execution successfull')
-        if len(self.consecutive_exceptions):
-            self.exceptions += self.consecutive_exceptions
+        self.metrics.observe(started, ended, True)
+        if self.downsince is not None:
             message = [
                 'After some failures, the process executed successfully again!',
                 'Anyway, here is a list of distinct exceptions raised since last successful run:',
             ]
-            detailed = []
-            message += self.format_exceptions_message(self.consecutive_exceptions, detailed)
+            detailed = set()
+            message += self.format_exceptions_message(self.consecutive, detailed)
 
             message.append('Also, here is a list of distinct exceptions raised before last successful run:')
-            message += self.format_exceptions_message(self.exceptions, detailed)
-            send_mail(
-                '[%s] %s' % (self.name, 'Process healed'),
-                "\n".join(message),
-                'critical@yourlabs.org',
-                [x[1] for x in settings.ADMINS],
-                fail_silently=False
-            )
+            message += self.format_exceptions_message(self.history.records, detailed)
+            self.mail_admins('Process healed', message)
 
             self.admin_emails.append({
                 'reason': Task.HEALED,
                 'datetime': datetime.datetime.now()
             })
-            self.log('debug', 'Sent email to admins: Process healed')
-        self.consecutive_exceptions = []
-        time.sleep(self.options['success_cooldown'].seconds)
+            self.log('debug', 'Notified admins: Process healed')
+        self.downsince = None
+        self.consecutive.clear()
+        self.consecutive_failures = 0
+        self.cooldown(self.backoff.cooldown(self, True, ended - started))
 
     def fail(self, started, ended, exc_type, exc_value, exc_tb):
         """
@@ -139,60 +602,38 @@ class Task(object):
         - Task.NON_RECOVERABLE_DOWNTIME_REACHED_AGAIN just to make sure the
           email stays in the top of the admin's mailbox
         """
-        
+        self.metrics.observe(started, ended, False)
+        record = self.history.capture(exc_type, exc_value, exc_tb,
+                                      started, ended)
+
         self.log('debug', 'Execution failed:')
-        self.log('debug', 'Exception  %s' % exc_value.__class__.__name__)
-        self.log('debug', 'Message  %s' % exc_value.message)
-        self.log('debug', ''.join(traceback.format_exception(
-            exc_type, exc_value, exc_tb)))
+        self.log('debug', 'Exception  %s' % record.name)
+        self.log('debug', 'Message  %s' % record.message)
+        self.log('debug', record.traceback)
 
+        if self.downsince is None:
+            self.downsince = started
+        self.consecutive_failures += 1
+
+        self.consecutive.pop(record.fingerprint, None)
+        self.consecutive[record.fingerprint] = True
+        while len(self.consecutive) > self.options['max_exceptions']:
+            self.consecutive.popitem(last=False)
 
         data = {
             'started': started,
             'ended': ended,
-            'duration': started - ended,
+            'duration': ended - started,
+            'fingerprint': record.fingerprint,
+            'downsince': self.downsince,
+            'downtime': ended - self.downsince,
         }
         notify_admins = False
 
-        if len(self.consecutive_exceptions):
-            data['downsince'] = self.consecutive_exceptions[0]['started']
-            data['downtime'] = datetime.datetime.now() - data['downsince']
-
-            # add exc_ stuff to data *only* if it differs from the last logged
-            # exc_data
-            for logged_data in reversed(self.consecutive_exceptions):
-                if 'exc_tb' in logged_data.keys():
-                    # only bloat with gory details if they are different
-                    # from last exception
-                    if not self.is_same_exception(exc_type, exc_value, exc_tb, logged_data):
-                        data.update({
-                            'exc_type': exc_type,
-                            'exc_value': exc_value,
-                            'exc_tb': exc_tb,
-                        })
-                    break
-        else:
-            data.update({
-                'exc_type': exc_type,
-                'exc_value': exc_value,
-                'exc_tb': exc_tb,
-                'downsince': ended,
-                'downtime': ended-started,
-            })
-
-        self.exceptions.append(data)
-        self.consecutive_exceptions.append(data)
-
-        if len(self.exceptions) == 1:
+        if self.history.total == 1:
             notify_admins = Task.FIRST_EXCEPTION
         else:
-            new = True
-            for logged_data in self.exceptions:
-                if self.is_same_exception(exc_type, exc_value, exc_tb, logged_data):
-                    new = False
-                    break
-            
-            if new:
+            if record.count == 1:
                 notify_admins = Task.NEW_EXCEPTION
             elif data['downtime'] >= self.options['non_recoverable_downtime']:
                 last_downtime_email = None
@@ -213,17 +654,25 @@ class Task(object):
         if notify_admins:
             self.notify_admins(data, notify_admins)
 
-        self.log('debug', 'Sleeping %s seconds' % 
-            self.options['fail_cooldown'].seconds)
-        time.sleep(self.options['fail_cooldown'].seconds)
+        self.cooldown(self.backoff.cooldown(self, False, ended - started))
+
+    def cooldown(self, delta):
+        """
+        Set the next_run datetime, the runner's scheduler takes care of
+        waiting until then.
+        """
+        self.next_run = datetime.datetime.now() + delta
+        self.last_cooldown = delta
+        self.metrics.observe_cooldown(delta)
+        self.log('debug', 'Next run in %s', delta)
 
     def notify_admins(self, data, reason):
-        exc_type, exc_value, exc_tb = self.get_exception_data_for(data)
+        record = self.history.records[data['fingerprint']]
 
         if reason == Task.FIRST_EXCEPTION:
-            subject = 'First exception caught: %s' % exc_value.message
+            subject = 'First exception caught: %s' % record.message
         elif reason == Task.NEW_EXCEPTION:
-            subject = 'New exception caught: %s' % exc_value.message
+            subject = 'New exception caught: %s' % record.message
         elif reason == Task.NON_RECOVERABLE_DOWNTIME_REACHED:
             subject = 'Non recoverable downtime reached'
         elif reason == Task.NON_RECOVERABLE_DOWNTIME_REACHED_AGAIN:
@@ -232,86 +681,91 @@ class Task(object):
         message = ['Current state details:']
         message.append('Down since  %s' % data['downsince'])
         message.append('Down time  %s' % data['downtime'])
-        message.append('Exception  %s' % exc_value.__class__.__name__)
-        message.append('Message  %s' % exc_value.message)
-        message.append(''.join(traceback.format_exception(
-            exc_type, exc_value, exc_tb)))
+        message.append('Exception  %s' % record.name)
+        message.append('Message  %s' % record.message)
+        message.append(record.traceback)
 
         message.append('')
         message.append('')
 
         if reason != Task.FIRST_EXCEPTION:
             message.append('Also, here is a list of distinct exceptions raised:')
-            message += self.format_exceptions_message(self.exceptions)
-
+            message += self.format_exceptions_message(self.history.records)
 
-        send_mail(
-            '[%s] %s' % (
-                self.name,
-                subject
-            ),
-            "\n".join(message),
-            'critical@yourlabs.org',
-            [x[1] for x in settings.ADMINS],
-            fail_silently=False
-        )
+        self.mail_admins(subject, message)
 
         self.admin_emails.append({
             'reason': reason,
             'datetime': datetime.datetime.now()
         })
 
-        self.log('debug', 'Sent email to admins: %s', subject)
+        self.log('debug', 'Notified admins: %s', subject)
 
-    def is_same_exception(self, exc_type, exc_value, exc_tb, data):
-        if 'exc_type' not in data.keys():
-            return True
+    def mail_admins(self, subject, message):
+        """
+        Queue an email to the admins, it is sent by the notifier's thread.
+        """
+        self.notifier.notify('[%s] %s' % (self.name, subject),
+                             "\n".join(message))
+
+    def dump_state(self):
+        return {
+            'next_run': self.next_run,
+            'downsince': self.downsince,
+            'consecutive': list(self.consecutive),
+            'consecutive_failures': self.consecutive_failures,
+            'total': self.history.total,
+            'admin_emails': list(self.admin_emails),
+        }
 
-        tb = traceback.format_exception(exc_type, exc_value, exc_tb)
-        tb2 =traceback.format_exception(
-                data['exc_type'], data['exc_value'], data['exc_tb'])
+    def load_state(self, state, records):
+        self.next_run = state['next_run']
+        self.downsince = state['downsince']
+        for fingerprint in state['consecutive']:
+            self.consecutive[fingerprint] = True
+        self.consecutive_failures = state.get('consecutive_failures', 0)
+        self.history.load(records, state['total'])
+        self.admin_emails.extend(state['admin_emails'])
 
-        if exc_type != data['exc_type']:
-            return False
-        if exc_value.message != data['exc_value'].message:
-            return False
-        if ''.join(tb) != ''.join(tb2):
-            return False
-        return True
-    
-    def get_exception_data_for(self, data):
-        if 'exc_tb' in data.keys():
-            return (data['exc_type'], data['exc_value'], data['exc_tb'])
-
-        for logged_data in reversed(self.consecutive_exceptions):
-            if 'exc_tb' in logged_data.keys():
-                return (logged_data['exc_type'], logged_data['exc_value'], 
-                        logged_data['exc_tb'])
-
-    def format_exceptions_message(self, exceptions, detailed=None):
+    def restore_state(self, backend):
+        """
+        Restore the state saved by a previous runner, so that known exceptions
+        are not notified again and the schedule is kept.
+        """
+        # for tasks which save their state during runs
+        self.state_backend = backend
+        state, records = backend.load(self.path,
+                                      self.options['max_exceptions'])
+        if state is not None:
+            self.load_state(state, records)
+            self.log('debug', 'Restored state, next run at %s', self.next_run)
+
+    def save_state(self, backend):
+        records, forgotten = self.history.pop_changes()
+        backend.save(self.path, self.dump_state(), records, forgotten)
+
+    def is_same_exception(self, exc_type, exc_value, exc_tb, data):
+        return history.fingerprint(exc_type, exc_value, exc_tb) == \
+            data['fingerprint']
+
+    def format_exceptions_message(self, fingerprints, detailed=None):
         message = []
         
         if detailed is None:
-            detailed = []
+            detailed = set()
 
-        for data in exceptions:
-            if 'exc_value' not in data.keys():
+        for fingerprint in fingerprints:
+            record = self.history.records.get(fingerprint, None)
+            if record is None or fingerprint in detailed:
+                # forgotten, or already detailed
                 continue
 
-            new = True
-
-            for detailed_data in detailed:
-                if self.is_same_exception(data['exc_type'], 
-                    data['exc_value'], data['exc_tb'], detailed_data):
-                    new = False
-                    break
-            
-            if new:
-                message.append('')
-                message.append('Exception  %s' % data['exc_value'].__class__.__name__)
-                message.append('Message  %s' % data['exc_value'].message)
-                message.append(''.join(traceback.format_exception(
-                    data['exc_type'], data['exc_value'], data['exc_tb'])))
-            detailed.append(data)
+            message.append('')
+            message.append('Exception  %s' % record.name)
+            message.append('Message  %s' % record.message)
+            message.append('Seen  %s times from %s to %s' % (
+                record.count, record.first_seen, record.last_seen))
+            message.append(record.traceback)
+            detailed.add(fingerprint)
 
         return message
@@ -0,0 +1,220 @@
+import datetime
+import sys
+import threading
+import traceback
+
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+from yourlabs.runner import PARKED, TaskRunner, TaskTimeout
+from yourlabs.runner.scheduler import total_seconds
+
+# threads running the imports, state saves and lease queries of the runner
+BOOKKEEPING_THREADS = 2
+
+
+def is_coroutine_function(function):
+    return asyncio is not None and asyncio.iscoroutinefunction(function)
+
+
+class AsyncTaskRunner(TaskRunner):
+    """
+    Run tasks on an asyncio event loop.
+
+    Coroutine functions run concurrently on the loop, blocking functions are
+    offloaded to a pool of `workers` threads. Cooldowns are loop timers, so
+    thousands of I/O bound tasks cost one thread.
+
+    Requires asyncio, or trollius on Python 2.
+    """
+    def __init__(self, task_names, **kwargs):
+        if asyncio is None:
+            raise ImproperlyConfigured('AsyncTaskRunner requires asyncio '
+                                       'or trollius')
+
+        super(AsyncTaskRunner, self).__init__(task_names, **kwargs)
+        self.loop = None
+        self.loop_thread = None
+        # runs prepare() and ran()
+        self.bookkeeper = None
+        # runs being prepared, running or saved
+        self.running = 0
+        # ref -> timer of its next run
+        self.handles = {}
+        # refs woken up while running
+        self.woken = set()
+
+    def run(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.start()
+
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.current_thread()
+        # so that coroutines which don't pass the loop around use this one
+        asyncio.set_event_loop(self.loop)
+        self.loop.set_default_executor(ThreadPoolExecutor(self.workers))
+        # apart, so that blocking functions don't hold up the others
+        self.bookkeeper = ThreadPoolExecutor(BOOKKEEPING_THREADS)
+
+        for ref in self.refs:
+            self.schedule(ref)
+
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+            self.bookkeeper.shutdown()
+
+        self.disarm()
+        self.stop()
+        self.log('debug', 'Drained, exiting')
+
+    def drain(self):
+        super(AsyncTaskRunner, self).drain()
+        if self.loop is not None and not self.running:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def in_loop(self):
+        return threading.current_thread() is self.loop_thread
+
+    def schedule(self, ref, when=None):
+        if not self.in_loop():
+            # from prepare() in the bookkeeper
+            self.loop.call_soon_threadsafe(self.schedule, ref, when)
+            return
+
+        handle = self.handles.pop(ref, None)
+        if handle is not None:
+            handle.cancel()
+
+        if ref in self.woken:
+            self.woken.discard(ref)
+            when = None
+
+        if when is PARKED:
+            # no timer, woke() schedules it
+            self.handles[ref] = None
+            return
+
+        delay = 0
+        if when is not None:
+            delay = max(0, total_seconds(when - datetime.datetime.now()))
+        self.handles[ref] = self.loop.call_later(delay, self.run_task, ref)
+
+    def arm(self, ref):
+        if not self.in_loop():
+            # signal handlers can only be installed by the main thread
+            self.loop.call_soon_threadsafe(super(AsyncTaskRunner, self).arm,
+                                           ref)
+            return
+        super(AsyncTaskRunner, self).arm(ref)
+
+    def wake(self, ref):
+        self.loop.call_soon_threadsafe(self.woke, ref)
+
+    def woke(self, ref):
+        if ref in self.handles:
+            self.schedule(ref)
+        else:
+            self.woken.add(ref)
+
+    def run_task(self, ref):
+        """
+        Prepare ref in the bookkeeper, as it may import modules, restore a
+        state or take a lease, then run its task.
+        """
+        self.handles.pop(ref, None)
+        if self.draining:
+            return
+
+        self.running += 1
+        future = self.loop.run_in_executor(self.bookkeeper, self.prepare, ref)
+        future.add_done_callback(lambda future: self.prepared(ref, future))
+
+    def prepared(self, ref, future):
+        try:
+            task = future.result()
+        except Exception:
+            self.failed(ref)
+            return
+
+        if task is None or self.draining:
+            self.finished()
+            return
+
+        started = datetime.datetime.now()
+
+        if is_coroutine_function(task.function):
+            future = task.function()
+            if task.options['timeout']:
+                future = asyncio.wait_for(future, task.options['timeout'])
+            future = asyncio.ensure_future(future, loop=self.loop)
+        else:
+            call = task.call
+            if task.profiler is not None:
+                call = task.profiler.call
+            future = self.loop.run_in_executor(None, call)
+
+        future.add_done_callback(
+            lambda future: self.done(ref, started, future))
+
+    def done(self, ref, started, future):
+        task = ref.task
+        ended = datetime.datetime.now()
+
+        try:
+            try:
+                future.result()
+            except asyncio.TimeoutError:
+                try:
+                    raise TaskTimeout('Timed out after %s seconds' %
+                                      task.options['timeout'])
+                except TaskTimeout:
+                    task.fail(started, ended, *sys.exc_info())
+            except Exception:
+                task.fail(started, ended, *sys.exc_info())
+            else:
+                task.success(started, ended)
+        except Exception:
+            self.failed(ref)
+            return
+
+        # writes the state and metrics files
+        future = self.loop.run_in_executor(self.bookkeeper, self.ran, task)
+        future.add_done_callback(lambda future: self.saved(ref, future))
+
+    def saved(self, ref, future):
+        try:
+            future.result()
+            self.propagate(ref)
+        except Exception:
+            self.failed(ref)
+            return
+
+        self.finished()
+        if not self.draining:
+            self.schedule(ref, self.next_run(ref))
+
+    def failed(self, ref):
+        """
+        Log an error of the runner itself and retry ref later, see
+        TaskRunner.run_safely().
+        """
+        self.log('error', 'Error while running %s:\n%s', ref.path,
+                 traceback.format_exc())
+        self.finished()
+        if not self.draining:
+            self.schedule(ref, self.retry(ref))
+
+    def finished(self):
+        self.running -= 1
+        if self.draining and not self.running:
+            self.loop.stop()
@@ -0,0 +1,146 @@
+import collections
+import datetime
+import random
+
+from scheduler import total_seconds
+
+
+def seconds(value):
+    return datetime.timedelta(seconds=value)
+
+
+class Backoff(object):
+    """
+    Computes the cooldown of a task after a run, from the task's
+    success_cooldown and fail_cooldown options.
+
+    jitter is the fraction of the cooldown which is randomized, so that
+    runners started with the same settings don't hit shared resources in
+    lockstep.
+    """
+    def __init__(self, jitter=0):
+        self.jitter = jitter
+
+    def cooldown(self, task, success, duration):
+        if success:
+            delta = self.success_cooldown(task, duration)
+        else:
+            delta = self.fail_cooldown(task, duration)
+
+        if self.jitter:
+            delta = seconds(total_seconds(delta) *
+                            random.uniform(1 - self.jitter, 1 + self.jitter))
+        return delta
+
+    def success_cooldown(self, task, duration):
+        return task.options['success_cooldown']
+
+    def fail_cooldown(self, task, duration):
+        return task.options['fail_cooldown']
+
+
+class Fixed(Backoff):
+    """
+    Always wait success_cooldown or fail_cooldown, the default.
+    """
+
+
+class Exponential(Backoff):
+    """
+    Multiply fail_cooldown by factor after each consecutive failure, up to
+    max, non_recoverable_downtime by default.
+    """
+    def __init__(self, factor=2, max=None, jitter=.1):
+        super(Exponential, self).__init__(jitter)
+        self.factor = factor
+        self.max = max
+
+    def fail_cooldown(self, task, duration):
+        limit = total_seconds(self.max or
+                              task.options['non_recoverable_downtime'])
+        # clamp in seconds, a timedelta overflows after a few dozen failures
+        exponent = min(task.consecutive_failures - 1, 64)
+        return seconds(min(limit,
+            total_seconds(task.options['fail_cooldown']) *
+            self.factor ** exponent))
+
+
+class DecorrelatedJitter(Backoff):
+    """
+    Wait a random time between base and three times the previous cooldown,
+    up to cap. base defaults to fail_cooldown and cap to ten times base.
+
+    Retries are spread much better than with exponential backoff while the
+    first ones stay short, which shortens the time to heal.
+    """
+    def __init__(self, base=None, cap=None):
+        super(DecorrelatedJitter, self).__init__(0)
+        self.base = base
+        self.cap = cap
+
+    def fail_cooldown(self, task, duration):
+        base = total_seconds(self.base or task.options['fail_cooldown'])
+        cap = total_seconds(self.cap) if self.cap else base * 10
+
+        previous = base
+        if task.consecutive_failures > 1 and task.last_cooldown:
+            previous = total_seconds(task.last_cooldown)
+
+        return seconds(min(cap, random.uniform(base, previous * 3)))
+
+
+class Adaptive(Backoff):
+    """
+    Adapt cooldowns to the last window runs of a task.
+
+    After a failure, the task is retried after fail_cooldown multiplied by
+    its failure rate, at least min_factor: a task which fails once in a while
+    is retried quickly, and one which keeps failing waits fail_cooldown.
+
+    After a success, the task waits at least duration multiplied by
+    load_factor, so that a task which gets slower also runs less often.
+    """
+    def __init__(self, window=20, min_factor=.1, load_factor=1, jitter=.1):
+        super(Adaptive, self).__init__(jitter)
+        self.window = window
+        self.min_factor = min_factor
+        self.load_factor = load_factor
+        self.results = {}
+
+    def cooldown(self, task, success, duration):
+        if task.path not in self.results:
+            self.results[task.path] = collections.deque(maxlen=self.window)
+        self.results[task.path].append(success)
+        return super(Adaptive, self).cooldown(task, success, duration)
+
+    def failure_rate(self, task):
+        results = self.results[task.path]
+        return float(results.count(False)) / len(results)
+
+    def success_cooldown(self, task, duration):
+        return max(task.options['success_cooldown'],
+                   seconds(total_seconds(duration) * self.load_factor))
+
+    def fail_cooldown(self, task, duration):
+        factor = max(self.min_factor, self.failure_rate(task))
+        return seconds(total_seconds(task.options['fail_cooldown']) * factor)
+
+
+POLICIES = {
+    'fixed': Fixed,
+    'exponential': Exponential,
+    'decorrelated_jitter': DecorrelatedJitter,
+    'adaptive': Adaptive,
+}
+
+
+def get_backoff(backoff):
+    """
+    Return a Backoff instance for a Backoff instance, a name of POLICIES or
+    None for Fixed.
+    """
+    if backoff is None:
+        return Fixed()
+    if isinstance(backoff, basestring):
+        return POLICIES[backoff]()
+    return backoff
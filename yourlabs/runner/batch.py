@@ -0,0 +1,127 @@
+"""
+Tasks which process all the items of a source by chunks, for example::
+
+    from yourlabs.runner import batch
+
+    @batch.task(lambda: Message.objects.filter(sent=False), chunk_size=50)
+    def send_messages(messages):
+        for message in messages:
+            message.send()
+
+The key of the last item of each processed chunk is saved in the task state,
+so that a run which failed, or a runner which was restarted, resumes after
+the last processed chunk rather than from the start.
+"""
+import itertools
+
+from django.db.models import Manager
+from django.db.models.query import QuerySet
+
+from yourlabs.runner import Task
+
+
+def task(source, chunk_size=100, key='pk', **options):
+    """
+    Decorate a function which handles a list of items as a BatchTask.
+    """
+    def wrapper(f):
+        f.runner_task = BatchTask(f, source, chunk_size, key, **options)
+        return f
+    return wrapper
+
+
+class BatchTask(Task):
+    """
+    Calls handler with chunks of at most chunk_size items of source, which
+    is a queryset, an iterable or a callable returning one of those, called
+    at each run.
+
+    key is the name of the field or attribute items are ordered by, or for
+    iterables a callable returning the key of an item. Querysets are
+    filtered and ordered by key, so that only one chunk at a time is loaded
+    in memory. Iterables must yield items in ascending key order.
+
+    Batch tasks can't be isolated, the checkpoint would stay in the worker.
+    """
+    def __init__(self, handler, source, chunk_size=100, key='pk', **options):
+        self.handler = handler
+        self.source = source
+        self.chunk_size = chunk_size
+        self.key = key
+        # key of the last processed item, None if the last pass completed
+        self.checkpoint = None
+        super(BatchTask, self).__init__(handler, **options)
+        self.function = self.process
+
+        if self.options['isolate']:
+            raise ValueError('Batch task %s can not be isolated' % self.name)
+
+    def replace(self, other):
+        self.handler = other.handler
+        self.source = other.source
+        self.chunk_size = other.chunk_size
+        self.key = other.key
+        self.configure(**other.options)
+
+    def get_key(self, item):
+        if callable(self.key):
+            return self.key(item)
+        return getattr(item, self.key)
+
+    def chunks(self):
+        source = self.source
+        if callable(source):
+            source = source()
+        if isinstance(source, Manager):
+            source = source.all()
+
+        if isinstance(source, QuerySet):
+            source = source.order_by(self.key)
+            while True:
+                queryset = source
+                if self.checkpoint is not None:
+                    queryset = queryset.filter(**{
+                        '%s__gt' % self.key: self.checkpoint})
+                chunk = list(queryset[:self.chunk_size])
+                if not chunk:
+                    return
+                yield chunk
+        else:
+            items = iter(source)
+            if self.checkpoint is not None:
+                items = itertools.dropwhile(
+                    lambda item: self.get_key(item) <= self.checkpoint,
+                    items)
+            while True:
+                chunk = list(itertools.islice(items, self.chunk_size))
+                if not chunk:
+                    return
+                yield chunk
+
+    def process(self):
+        """
+        Handle the chunks of source from the checkpoint on, saving the
+        checkpoint after each chunk.
+        """
+        if self.checkpoint is not None:
+            self.log('debug', 'Resuming after %s', self.checkpoint)
+
+        for chunk in self.chunks():
+            self.handler(chunk)
+            self.checkpoint = self.get_key(chunk[-1])
+            self.log('debug', 'Processed %s items up to %s', len(chunk),
+                     self.checkpoint)
+            if self.state_backend is not None:
+                self.save_state(self.state_backend)
+
+        # start over at the next run
+        self.checkpoint = None
+
+    def dump_state(self):
+        state = super(BatchTask, self).dump_state()
+        state['checkpoint'] = self.checkpoint
+        return state
+
+    def load_state(self, state, records):
+        super(BatchTask, self).load_state(state, records)
+        self.checkpoint = state.get('checkpoint')
@@ -0,0 +1,156 @@
+"""
+Benchmarks of the overhead the runner adds to task runs, run with::
+
+    ./manage.py benchmark_runner [--sizes 10,100,1000] [--time 1]
+
+Synthetic no-op and failing tasks run with cooldowns of zero, a notifier
+which doesn't send anything and a logger which doesn't output anything.
+Failure paths are measured for increasing numbers of recorded exceptions.
+
+For each benchmark, the number of operations per second and the memory
+allocated are reported: the peak traced by tracemalloc if available,
+otherwise the growth of the resident set size.
+"""
+import datetime
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from yourlabs.runner import Task, daemon, isolation, notify
+
+LOGGER = 'runner.benchmark'
+
+
+class NullNotifier(notify.Notifier):
+    def notify(self, subject, body):
+        pass
+
+
+def noop():
+    pass
+
+
+def make_task(function=noop, max_exceptions=100):
+    return Task(function, success_cooldown=0, fail_cooldown=0,
+                logger_name=LOGGER, notifier=NullNotifier(),
+                max_exceptions=max_exceptions,
+                max_occurrences=max_exceptions)
+
+
+def raise_error(message):
+    raise ValueError(message)
+
+
+def fail(task, message):
+    try:
+        raise_error(message)
+    except ValueError:
+        now = datetime.datetime.now()
+        task.fail(now, now, *sys.exc_info())
+
+
+def fill(task, size):
+    """
+    Make task record size distinct exceptions.
+    """
+    for i in range(size):
+        fail(task, 'error %s' % i)
+
+
+def measure(function, duration):
+    """
+    Call function repeatedly for about duration seconds, return the number
+    of calls per second and the bytes allocated meanwhile.
+    """
+    if tracemalloc is not None:
+        tracemalloc.start()
+    else:
+        rss = isolation.rss()
+
+    calls = 0
+    started = timeit.default_timer()
+    elapsed = 0
+    while elapsed < duration:
+        for i in xrange(10):
+            function()
+        calls += 10
+        elapsed = timeit.default_timer() - started
+
+    if tracemalloc is not None:
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        memory = isolation.rss() - rss
+
+    return calls / elapsed, memory
+
+
+def benchmarks(sizes, directory):
+    """
+    Yield (name, function) of the benchmarks.
+    """
+    task = make_task()
+    yield 'Task.run no-op', task.run
+
+    def fails():
+        raise_error('failing')
+    task = make_task(fails)
+    yield 'Task.run failing, new task', task.run
+
+    for size in sizes:
+        task = make_task(fails, size)
+        fill(task, size)
+        yield 'Task.run failing, %s known exceptions' % size, task.run
+
+        task = make_task(max_exceptions=size)
+        fill(task, size)
+        counter = iter(xrange(sys.maxint))
+
+        def fail_new(task=task):
+            fail(task, 'new error %s' % next(counter))
+        yield 'Task.fail new exception, %s known exceptions' % size, \
+            fail_new
+
+        def format_all(task=task):
+            task.format_exceptions_message(task.history.records)
+        yield 'format_exceptions_message, %s exceptions' % size, format_all
+
+    pidfile = os.path.join(directory, 'benchmark')
+
+    def concurrency_security():
+        d = daemon.Daemon(pidfile, LOGGER)
+        d.concurrency_security()
+        os.close(d.pidfile_fd)
+    yield 'Daemon.concurrency_security', concurrency_security
+
+
+def run(sizes=(10, 100, 1000), duration=1, stdout=sys.stdout):
+    """
+    Run each benchmark for duration seconds and write a report to stdout.
+    """
+    logger = logging.getLogger(LOGGER)
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    directory = tempfile.mkdtemp(prefix='runner-benchmark')
+    try:
+        stdout.write('%-50s %12s %12s\n' % ('benchmark', 'ops/sec',
+                                             'memory (kB)'))
+        for name, function in benchmarks(sizes, directory):
+            ops, memory = measure(function, duration)
+            stdout.write('%-50s %12.1f %12.1f\n' % (name, ops,
+                                                     memory / 1024.))
+    finally:
+        shutil.rmtree(directory)
+
+    if tracemalloc is None:
+        stdout.write('(memory is the RSS growth, install tracemalloc for '
+                     'peaks)\n')
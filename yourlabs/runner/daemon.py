@@ -1,13 +1,22 @@
+import errno
+import fcntl
 import os
 import signal
 import logging
 import time
 
 class Daemon(object):
-    def __init__(self, pidfile, logger=None, allow_concurrent=False):
+    # sent to a running instance to make it exit after its current task
+    drain_signal = signal.SIGUSR1
+
+    def __init__(self, pidfile, logger=None, allow_concurrent=False,
+                 handover_timeout=30):
         self.pidfile = pidfile
         self.logger = logger
         self.allow_concurrent = allow_concurrent
+        self.handover_timeout = handover_timeout
+        self.pidfile_fd = None
+        self.draining = False
 
     def log(self, level, message, *args):
         if self.logger is None:
@@ -16,53 +25,100 @@ class Daemon(object):
             self.logger = logging.getLogger(self.logger)
         level = getattr(logging, level.upper())
         self.logger.log(level, message % args)
-    
+
+    def lock(self):
+        try:
+            fcntl.flock(self.pidfile_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+        return True
+
+    def read_pid(self):
+        os.lseek(self.pidfile_fd, 0, os.SEEK_SET)
+        try:
+            return int(os.read(self.pidfile_fd, 32).strip())
+        except ValueError:
+            # not written yet
+            return None
+
     def concurrency_security(self):
-        if os.path.exists(self.pidfile):
-            try:
-                f = open(self.pidfile, 'r')
-                concurrent = f.read()
-                f.close()
-                self.log('debug', 
-                    'Found pidfile %s containing: %s', self.pidfile, concurrent)
-            except Exception:
-                self.log('error', 
-                    'Could not read pidfile %s', self.pidfile)
-
-            if os.path.exists('/proc/%s' % concurrent):
-                if not self.allow_concurrent:
-                    os.kill(int(concurrent), signal.SIGTERM)
-                    self.log('debug', 'Sent SIGTERM to: %s' % concurrent)
-
-                    i = 0
-                    while os.path.exists('/proc/%s' % concurrent):
-                        time.sleep(5)
-                        if i == 5:
-                            self.log('error', 
-                                'Exiting because concurrent PID %s is still there',
-                                concurrent)
-                            os._exit(-1)
-                        else:
-                            self.log('debug', 
-                                '/proc/%s still exists, waiting another 5 seconds',
-                                concurrent)
-                else:
-                    self.log('error', 
-                        '%s contains a pid (%s) which is still running !',
-                        self.pidfile, concurrent)
-                    os._exit(-1)
-            else:
-                self.log('debug', 'Could not find /proc/%s, wiping pidfile %s', 
-                        concurrent, self.pidfile)
-                os.remove(self.pidfile)
+        """
+        Hold an exclusive lock on the pidfile for the lifetime of the process.
+
+        If another process holds it, it is sent drain_signal: it exits as
+        soon as its current task ends, and this process takes the lock right
+        away. It is killed if it is still there after handover_timeout
+        seconds.
+
+        The lock is released by the kernel when a process dies, so a pidfile
+        left by a crash or a power outage is just reused.
+        """
+        self.pidfile_fd = os.open(self.pidfile, os.O_RDWR | os.O_CREAT, 0644)
+
+        if not self.lock():
+            concurrent = self.read_pid()
+            self.log('debug',
+                'Found locked pidfile %s containing: %s', self.pidfile,
+                concurrent)
+
+            if self.allow_concurrent:
+                self.log('error',
+                    '%s is locked by a pid (%s) which is still running !',
+                    self.pidfile, concurrent)
+                os._exit(-1)
+
+            self.handover(concurrent)
         else:
-            self.log('debug', 
-                'Did not find pidfile %s, continuing normally', self.pidfile)
-
-        f = open(self.pidfile, 'w')
-        f.write(str(os.getpid()))
-        f.flush()
-        # Forcibly sync disk
-        os.fsync(f.fileno())
-        f.close()
+            self.log('debug', 'Locked pidfile %s', self.pidfile)
+
+        os.ftruncate(self.pidfile_fd, 0)
+        os.lseek(self.pidfile_fd, 0, os.SEEK_SET)
+        os.write(self.pidfile_fd, str(os.getpid()))
         self.log('debug', 'Wrote pidfile %s', self.pidfile)
+
+        signal.signal(self.drain_signal, self.handle_drain_signal)
+        signal.signal(signal.SIGTERM, self.handle_drain_signal)
+
+    def handover(self, concurrent):
+        started = time.time()
+        signaled = None
+
+        while not self.lock():
+            if signaled != concurrent and concurrent is not None:
+                try:
+                    os.kill(concurrent, self.drain_signal)
+                    self.log('debug', 'Sent drain signal to: %s', concurrent)
+                except OSError:
+                    pass
+                signaled = concurrent
+
+            if time.time() - started > self.handover_timeout:
+                self.log('error',
+                    'Killing concurrent PID %s which did not exit after %s '
+                    'seconds', concurrent, self.handover_timeout)
+                try:
+                    os.kill(concurrent, signal.SIGKILL)
+                except (OSError, TypeError):
+                    pass
+                # SIGKILL can't be caught, the lock is released at once
+                fcntl.flock(self.pidfile_fd, fcntl.LOCK_EX)
+                break
+
+            time.sleep(.01)
+            if concurrent is None:
+                concurrent = self.read_pid()
+
+        self.log('debug', 'Took over pidfile %s after %.3f seconds',
+                 self.pidfile, time.time() - started)
+
+    def handle_drain_signal(self, signum, frame):
+        self.log('debug', 'Received signal %s, draining', signum)
+        self.drain()
+
+    def drain(self):
+        """
+        Exit after the current work, override to stop the work loop.
+        """
+        self.draining = True
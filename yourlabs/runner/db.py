@@ -0,0 +1,120 @@
+"""
+Database connections of long running runners.
+
+Django opens a connection per thread and database, and only closes it at
+the end of a request, which never comes in a runner. managed() wraps task
+runs so that, in the thread running the task:
+
+- connections opened more than settings.RUNNER_DB_MAX_AGE seconds ago
+  (default: 3600) are closed before the run,
+- connections unused for more than settings.RUNNER_DB_PING_AFTER seconds
+  (default: 60) are pinged before the run, and closed if the ping fails,
+- connections are closed after a run which failed with a database error,
+
+so that the next query reconnects after a database restart or an idle
+timeout.
+"""
+import contextlib
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+local = threading.local()
+
+
+def is_connection_error(exception):
+    # drivers' InterfaceError and OperationalError are not always wrapped
+    return isinstance(exception, DatabaseError) or \
+        exception.__class__.__name__ in ('InterfaceError', 'OperationalError')
+
+
+def close(connection):
+    try:
+        connection.close()
+    except Exception:
+        # broken anyway
+        connection.connection = None
+
+
+def close_all():
+    """
+    Close the connections of the current thread.
+    """
+    for connection in connections.all():
+        if connection.connection is not None:
+            close(connection)
+
+
+def ping(connection):
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.fetchall()
+        return True
+    except Exception:
+        return False
+
+
+def prepare():
+    """
+    Close the connections of the current thread which are too old, or idle
+    and don't answer a ping.
+    """
+    seen = getattr(local, 'seen', {})
+    max_age = getattr(settings, 'RUNNER_DB_MAX_AGE', 3600)
+    ping_after = getattr(settings, 'RUNNER_DB_PING_AFTER', 60)
+    now = time.time()
+
+    for connection in connections.all():
+        if connection.connection is None:
+            continue
+
+        raw, opened, used = seen.get(connection.alias, (None, now, now))
+        if raw is not connection.connection:
+            continue
+
+        if max_age is not None and now - opened > max_age:
+            close(connection)
+        elif ping_after is not None and now - used > ping_after and \
+                not ping(connection):
+            close(connection)
+
+
+def track():
+    """
+    Remember when the connections of the current thread were opened and
+    last used.
+    """
+    if not hasattr(local, 'seen'):
+        local.seen = {}
+    now = time.time()
+
+    for connection in connections.all():
+        if connection.connection is None:
+            local.seen.pop(connection.alias, None)
+            continue
+
+        raw, opened, used = local.seen.get(connection.alias,
+                                           (None, now, now))
+        if raw is not connection.connection:
+            opened = now
+        local.seen[connection.alias] = (connection.connection, opened, now)
+
+
+@contextlib.contextmanager
+def managed():
+    """
+    Prepare the connections of the current thread for a run and track them
+    afterwards, closing them if the run failed with a database error.
+    """
+    prepare()
+    try:
+        yield
+    except Exception as e:
+        if is_connection_error(e):
+            close_all()
+        raise
+    finally:
+        track()
@@ -0,0 +1,162 @@
+import collections
+import hashlib
+import traceback
+
+
+def fingerprint(exc_type, exc_value, exc_tb):
+    """
+    Return a stable hash of an exception: its type, message and frames.
+
+    Frames are reduced to file, function and source line, without line
+    numbers, so that an unrelated edit elsewhere in a module does not make an
+    exception look new.
+    """
+    parts = traceback.format_exception_only(exc_type, exc_value)
+    for filename, lineno, name, line in traceback.extract_tb(exc_tb):
+        parts.append('%s %s %s' % (filename, name, line))
+
+    text = '\n'.join(parts)
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+def exception_message(exc_value):
+    try:
+        return unicode(exc_value)
+    except UnicodeError:
+        return repr(exc_value)
+
+
+class RemoteException(Exception):
+    """
+    Exception raised in another process, carrying what describe() returned
+    there.
+    """
+    def __init__(self, fingerprint, name, message, traceback):
+        super(RemoteException, self).__init__(message)
+        self.fingerprint = fingerprint
+        self.name = name
+        self.message = message
+        self.traceback = traceback
+
+
+def describe(exc_type, exc_value, exc_tb):
+    """
+    Return the fingerprint, class name, message and formatted traceback of
+    an exception.
+    """
+    if isinstance(exc_value, RemoteException):
+        return (exc_value.fingerprint, exc_value.name, exc_value.message,
+                exc_value.traceback)
+
+    return (fingerprint(exc_type, exc_value, exc_tb), exc_type.__name__,
+            exception_message(exc_value),
+            ''.join(traceback.format_exception(exc_type, exc_value, exc_tb)))
+
+
+class ExceptionRecord(object):
+    """
+    Compact record of a distinct exception: the traceback is formatted once
+    and no frame is kept alive.
+    """
+    def __init__(self, fingerprint, name, message, traceback, when):
+        self.fingerprint = fingerprint
+        self.name = name
+        self.message = message
+        self.traceback = traceback
+        self.first_seen = when
+        self.last_seen = when
+        self.count = 0
+
+    def dump(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def load(cls, data):
+        record = cls(data['fingerprint'], data['name'], data['message'],
+                     data['traceback'], data['first_seen'])
+        record.last_seen = data['last_seen']
+        record.count = data['count']
+        return record
+
+
+class ExceptionHistory(object):
+    """
+    Bounded exception history of a task.
+
+    records maps fingerprints to ExceptionRecords, least recently seen first,
+    and holds at most max_records of them. occurrences is a ring buffer of the
+    last max_occurrences failures.
+
+    Fingerprints of records which changed or were forgotten since the last
+    pop_changes() call are tracked, for the state backend.
+    """
+    def __init__(self, max_records=100, max_occurrences=100):
+        self.max_records = max_records
+        self.records = collections.OrderedDict()
+        self.occurrences = collections.deque(maxlen=max_occurrences)
+        self.total = 0
+        self.changed = set()
+        self.forgotten = set()
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self.records
+
+    def capture(self, exc_type, exc_value, exc_tb, started, ended):
+        """
+        Record a failure and return the ExceptionRecord for its exception,
+        which count is 1 if the exception is new.
+        """
+        if isinstance(exc_value, RemoteException):
+            key = exc_value.fingerprint
+        else:
+            key = fingerprint(exc_type, exc_value, exc_tb)
+
+        record = self.records.pop(key, None)
+        if record is None:
+            key, name, message, formatted = describe(exc_type, exc_value,
+                                                     exc_tb)
+            record = ExceptionRecord(key, name, message, formatted, ended)
+
+        record.last_seen = ended
+        record.count += 1
+        self.records[key] = record
+        self.changed.add(key)
+        self.forgotten.discard(key)
+
+        while len(self.records) > self.max_records:
+            forgotten = self.records.popitem(last=False)[0]
+            self.changed.discard(forgotten)
+            self.forgotten.add(forgotten)
+
+        self.occurrences.append({
+            'started': started,
+            'ended': ended,
+            'duration': ended - started,
+            'fingerprint': key,
+        })
+        self.total += 1
+
+        return record
+
+    def load(self, records, total):
+        """
+        Restore records dumped by a previous process, least recently seen
+        first.
+        """
+        for data in records[-self.max_records:]:
+            record = ExceptionRecord.load(data)
+            self.records[record.fingerprint] = record
+        self.total = total
+
+    def pop_changes(self):
+        """
+        Return the dumps of changed records and the forgotten fingerprints
+        since the last call.
+        """
+        records = [self.records[key].dump() for key in self.changed]
+        forgotten = list(self.forgotten)
+        self.changed = set()
+        self.forgotten = set()
+        return records, forgotten
@@ -0,0 +1,227 @@
+import ctypes
+import ctypes.util
+import grp
+import multiprocessing
+import os
+import pwd
+import resource
+import signal
+import sys
+import threading
+import time
+
+from django.db import connections
+
+import db
+import history
+from timeout import TaskTimeout
+
+
+# prctl option to get a signal when the parent dies, linux only
+PR_SET_PDEATHSIG = 1
+
+# file descriptors of the runner which workers must not inherit
+private_fds = set()
+
+
+class WorkerDied(Exception):
+    pass
+
+
+def keep_private(fd):
+    """
+    Close fd in the worker processes, for example the pidfile which carries
+    the lock of the runner.
+    """
+    private_fds.add(fd)
+
+
+def die_with_parent():
+    """
+    Make the current process exit when its parent dies, even in the middle
+    of a run: with SIGKILL on linux, otherwise from a thread polling the
+    parent pid.
+    """
+    parent = os.getppid()
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if libc.prctl(PR_SET_PDEATHSIG, signal.SIGKILL) != 0:
+            raise OSError(ctypes.get_errno(), 'prctl failed')
+    except (OSError, AttributeError):
+        def watch():
+            while os.getppid() == parent:
+                time.sleep(1)
+            os._exit(1)
+
+        thread = threading.Thread(target=watch, name='runner-parent-watch')
+        thread.daemon = True
+        thread.start()
+    else:
+        if os.getppid() != parent:
+            # died before prctl
+            os._exit(1)
+
+
+def rss():
+    """
+    Return the resident set size of the current process in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except IOError:
+        # peak rather than current, but better than nothing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def setup(options):
+    """
+    Prepare a forked worker process: exit with the runner, close the file
+    descriptors and reset the signal handlers and database connections
+    inherited from the runner, apply the nice, rlimits, gid and uid options.
+    """
+    die_with_parent()
+
+    for fd in private_fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    for signum in (signal.SIGTERM, signal.SIGUSR1):
+        signal.signal(signum, signal.SIG_DFL)
+
+    for connection in connections.all():
+        # don't close the parent's socket, just forget it
+        connection.connection = None
+
+    if options['nice']:
+        os.nice(options['nice'])
+
+    for name, value in options['rlimits'].items():
+        resource.setrlimit(getattr(resource, 'RLIMIT_%s' % name.upper()),
+                           (value, value))
+
+    gid = options['gid']
+    if isinstance(gid, basestring):
+        gid = grp.getgrnam(gid).gr_gid
+
+    uid = options['uid']
+    if isinstance(uid, basestring):
+        uid = pwd.getpwnam(uid).pw_uid
+
+    # replace the supplementary groups of the runner, root's ones otherwise
+    if uid is not None:
+        user = pwd.getpwuid(uid)
+        os.initgroups(user.pw_name, user.pw_gid if gid is None else gid)
+    elif gid is not None:
+        os.setgroups([])
+
+    if gid is not None:
+        os.setgid(gid)
+    if uid is not None:
+        os.setuid(uid)
+
+
+def serve(function, connection, parent, options):
+    """
+    Worker process loop: run function each time the runner asks for it and
+    answer with the described exception if any, and the current RSS.
+    """
+    # or recv() would not get EOF when the runner is gone
+    parent.close()
+    setup(options)
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            # the runner is gone
+            return
+
+        if message is None:
+            return
+
+        try:
+            with db.managed():
+                function()
+            result = None
+        except Exception:
+            result = history.describe(*sys.exc_info())
+
+        connection.send((result, rss()))
+
+
+class IsolatedWorker(object):
+    """
+    Runs the function of a task in a forked process, which is recycled after
+    max_runs runs or once its RSS is over max_rss bytes, and killed if a run
+    times out.
+    """
+    def __init__(self, task):
+        self.task = task
+        self.process = None
+        self.connection = None
+        self.runs = 0
+
+    def start(self):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve,
+            args=(self.task.function, child, self.connection,
+                  self.task.options),
+            name='runner-%s' % self.task.name)
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.runs = 0
+        self.task.log('debug', 'Started worker %s', self.process.pid)
+
+    def stop(self, kill=False):
+        if self.process is None:
+            return
+
+        if not kill:
+            try:
+                self.connection.send(None)
+            except (IOError, OSError):
+                pass
+            self.process.join(5)
+
+        if self.process.is_alive():
+            os.kill(self.process.pid, signal.SIGKILL)
+            self.process.join()
+
+        self.connection.close()
+        self.task.log('debug', 'Stopped worker %s', self.process.pid)
+        self.process = None
+
+    def run(self, timeout=None):
+        if self.process is None or not self.process.is_alive():
+            self.start()
+
+        try:
+            self.connection.send('run')
+            if timeout and not self.connection.poll(timeout):
+                self.stop(kill=True)
+                raise TaskTimeout('Timed out after %s seconds' % timeout)
+            result, size = self.connection.recv()
+        except (EOFError, IOError):
+            self.process.join()
+            code = self.process.exitcode
+            self.process = None
+            raise WorkerDied('Worker exited with code %s' % code)
+
+        self.runs += 1
+        max_runs = self.task.options['max_runs']
+        max_rss = self.task.options['max_rss']
+        if max_runs and self.runs >= max_runs:
+            self.task.log('debug', 'Recycling worker after %s runs',
+                          self.runs)
+            self.stop()
+        elif max_rss and size > max_rss:
+            self.task.log('debug', 'Recycling worker using %s bytes', size)
+            self.stop()
+
+        if result is not None:
+            raise history.RemoteException(*result)
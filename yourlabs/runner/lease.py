@@ -0,0 +1,164 @@
+import datetime
+import logging
+import math
+import os
+import socket
+import threading
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+
+from models import TaskLease
+from scheduler import total_seconds
+
+logger = logging.getLogger('runner')
+
+NODE_PREFIX = 'node:'
+
+
+class LeaseManager(object):
+    """
+    Makes each task run on one node at a time, when the same tasks run on
+    several hosts sharing a database.
+
+    A node must hold the lease of a task to run it. Leases last ttl and are
+    renewed by a heartbeat thread, so the tasks of a dead node are taken over
+    once its leases expire. Nodes also lease a heartbeat row, which lets them
+    count live nodes: a node does not take more than its fair share of tasks
+    and releases the excess when another node joins, once their current run
+    is over.
+    """
+    def __init__(self, task_count, ttl=datetime.timedelta(seconds=15),
+                 node=None):
+        self.task_count = task_count
+        self.ttl = ttl
+        self.node = node or '%s:%s' % (socket.gethostname(), os.getpid())
+        self.held = set()
+        # tasks acquired and not done yet, see done()
+        self.running = set()
+        # fair share at the last heartbeat
+        self.share = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    @property
+    def node_lease(self):
+        return NODE_PREFIX + self.node
+
+    def start(self):
+        self.heartbeat()
+        self.thread = threading.Thread(target=self.loop,
+                                       name='runner-lease')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the heartbeat and release the leases of this node, before the
+        interpreter tears down the modules the thread uses.
+        """
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(total_seconds(self.ttl))
+        self.release_all()
+
+    def loop(self):
+        while not self.stopped.wait(total_seconds(self.ttl) / 3):
+            try:
+                self.heartbeat()
+            except Exception:
+                logger.exception('Could not renew leases of %s', self.node)
+
+    def fair_share(self, now):
+        nodes = TaskLease.objects.filter(name__startswith=NODE_PREFIX,
+                                         expires__gte=now).count()
+        return int(math.ceil(float(self.task_count) / max(nodes, 1)))
+
+    def heartbeat(self):
+        """
+        Renew the node and task leases, releasing idle tasks above the fair
+        share. Running tasks above it are released by done().
+        """
+        now = datetime.datetime.now()
+        self.take(self.node_lease, now)
+
+        with self.lock:
+            self.share = self.fair_share(now)
+            excess = len(self.held) - self.share
+            idle = sorted(self.held - self.running)
+            for name in idle[:max(excess, 0)]:
+                self.release(name)
+
+            TaskLease.objects.filter(owner=self.node,
+                name__in=list(self.held)).update(expires=now + self.ttl)
+
+    def acquire(self, name):
+        """
+        Return True if this node holds the lease of task name, taking it if
+        it is free and this node is under its fair share. The task is then
+        running until done() is called.
+        """
+        now = datetime.datetime.now()
+
+        with self.lock:
+            if name in self.held:
+                acquired = self.take(name, now)
+            elif len(self.held) >= self.fair_share(now):
+                acquired = False
+            elif self.take(name, now):
+                self.held.add(name)
+                logger.debug('%s took the lease of %s', self.node, name)
+                acquired = True
+            else:
+                acquired = False
+
+            if acquired:
+                self.running.add(name)
+            return acquired
+
+    def done(self, name):
+        """
+        Mark task name as not running, releasing its lease if this node held
+        more than its fair share at the last heartbeat.
+        """
+        with self.lock:
+            self.running.discard(name)
+            if name in self.held and self.share is not None and \
+                    len(self.held) > self.share:
+                self.release(name)
+
+    def take(self, name, now):
+        expires = now + self.ttl
+        updated = TaskLease.objects.filter(name=name).filter(
+            Q(owner=self.node) | Q(expires__lt=now)).update(
+                owner=self.node, expires=expires)
+        if updated:
+            return True
+
+        if TaskLease.objects.filter(name=name).exists():
+            # leased by another live node
+            self.held.discard(name)
+            return False
+
+        try:
+            with transaction.commit_on_success():
+                TaskLease.objects.create(name=name, owner=self.node,
+                                         expires=expires)
+        except IntegrityError:
+            # another node created it first
+            return False
+        return True
+
+    def release(self, name):
+        TaskLease.objects.filter(name=name, owner=self.node).delete()
+        self.held.discard(name)
+        logger.debug('%s released the lease of %s', self.node, name)
+
+    def release_all(self):
+        with self.lock:
+            for name in list(self.held):
+                self.release(name)
+            TaskLease.objects.filter(name=self.node_lease).delete()
@@ -0,0 +1,103 @@
+import os
+import sys
+import traceback
+
+from django.utils.importlib import import_module
+
+
+class TaskRef(object):
+    """
+    A task by dotted path to its function, imported when it is first due so
+    that a runner with many tasks starts fast.
+
+    With reload, the module of the function is reloaded before a run if its
+    source file changed, and the task takes the new function and options but
+    keeps its state and schedule.
+
+    options override those of the task, for example from the command line.
+    """
+    def __init__(self, path, reload=False, options=None):
+        self.path = path
+        self.module_name, self.name = path.rsplit('.', 1)
+        self.reload = reload
+        self.options = options or {}
+        self.task = None
+        self.mtime = None
+        # triggers started for the task
+        self.triggers = ()
+        # dependency graph, see TaskRunner.link()
+        self.depends = ()
+        self.upstreams = []
+        self.downstreams = []
+        # upstream refs which succeeded since the last run
+        self.satisfied = set()
+
+    def __repr__(self):
+        return '<TaskRef %s>' % self.path
+
+    def import_task(self):
+        from yourlabs.runner import task
+
+        module = import_module(self.module_name)
+        function = getattr(module, self.name)
+        if not hasattr(function, 'runner_task'):
+            function = task()(function)
+        # the function may be imported from another module
+        function.runner_task.path = self.path
+        if self.options:
+            function.runner_task.configure(**self.options)
+        return function.runner_task
+
+    def succeeded(self):
+        """
+        Return True if the task was loaded and its last run succeeded.
+        """
+        return self.task is not None and self.task.downsince is None and \
+            self.task.metrics.last_success is not None
+
+    def source_mtime(self):
+        filename = sys.modules[self.module_name].__file__
+        if filename.endswith(('.pyc', '.pyo')):
+            filename = filename[:-1]
+        try:
+            return os.stat(filename).st_mtime
+        except OSError:
+            return None
+
+    def load(self, backend):
+        """
+        Return the task, importing it and restoring its state from backend
+        the first time, reloading it if its source changed.
+        """
+        if self.task is None:
+            task = self.import_task()
+            task.restore_state(backend)
+            self.task = task
+            if self.reload:
+                self.mtime = self.source_mtime()
+        elif self.reload:
+            self.check()
+        return self.task
+
+    def check(self):
+        mtime = self.source_mtime()
+        if mtime == self.mtime:
+            return
+        # don't retry a broken module until it changes again
+        self.mtime = mtime
+
+        module = sys.modules[self.module_name]
+        try:
+            # another task of the module may have reloaded it already
+            if getattr(module, '__runner_mtime__', None) != mtime:
+                reload(module)
+                module.__runner_mtime__ = mtime
+            task = self.import_task()
+        except Exception:
+            self.task.log('error', 'Could not reload %s, keeping the '
+                          'previous version:' % self.module_name)
+            self.task.log('error', traceback.format_exc())
+            return
+
+        self.task.replace(task)
+        self.task.log('info', 'Reloaded %s', self.module_name)
@@ -0,0 +1,19 @@
+from optparse import make_option
+
+from yourlabs.runner import benchmark
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Measure the overhead of the runner on synthetic tasks'
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', dest='sizes', default='10,100,1000',
+            help='Comma separated numbers of recorded exceptions'),
+        make_option('--time', type='float', dest='time', default=1,
+            help='Seconds to run each benchmark for'),
+    )
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        benchmark.run(sizes, options['time'], self.stdout)
@@ -1,6 +1,9 @@
+import datetime
 import logging
+from optparse import make_option
 
 from yourlabs import runner
+from yourlabs.runner import aio, lease
 
 from django.utils.importlib import import_module
 
@@ -11,7 +14,50 @@ from django.conf import settings
 class Command(BaseCommand):
     args = '<module.function> [<module.function> ...]'
     help = 'Continuously run a set of functions'
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=1,
+            help='Number of tasks to run concurrently'),
+        make_option('--metrics-file', dest='metrics_file',
+            help='Path of a file to write task metrics to after each run'),
+        make_option('--metrics-port', type='int', dest='metrics_port',
+            help='Port to serve task metrics on, on localhost'),
+        make_option('--asyncio', action='store_true', dest='asyncio',
+            default=False,
+            help='Run tasks on an asyncio event loop, coroutine functions '
+                 'concurrently and others in --workers threads'),
+        make_option('--lease', action='store_true', dest='lease',
+            default=False,
+            help='Lease tasks in the database to run each on one node only'),
+        make_option('--lease-ttl', type='int', dest='lease_ttl', default=15,
+            help='Seconds before the tasks of a dead node are taken over'),
+        make_option('--reload', action='store_true', dest='reload',
+            default=False,
+            help='Reload the module of a task before a run if it changed'),
+        make_option('--profile-every', type='int', dest='profile_every',
+            help='Profile one run in N of each task'),
+        make_option('--profile-slower-than', type='float',
+            dest='profile_slower_than',
+            help='Profile runs and keep those slower than N seconds'),
+    )
 
     def handle(self, *args, **options):
-        r = runner.TaskRunner(args)
+        leases = None
+        if options['lease']:
+            leases = lease.LeaseManager(len(args),
+                datetime.timedelta(seconds=options['lease_ttl']))
+
+        task_options = {}
+        for option in ('profile_every', 'profile_slower_than'):
+            if options[option]:
+                task_options[option] = options[option]
+
+        runner_class = runner.TaskRunner
+        if options['asyncio']:
+            runner_class = aio.AsyncTaskRunner
+
+        r = runner_class(args, workers=options['workers'],
+                         metrics_file=options['metrics_file'],
+                         metrics_port=options['metrics_port'],
+                         leases=leases, reload=options['reload'],
+                         task_options=task_options)
         r.run()
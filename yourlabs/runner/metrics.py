@@ -0,0 +1,132 @@
+import os
+import os.path
+import tempfile
+import threading
+import time
+import BaseHTTPServer
+
+from scheduler import total_seconds
+
+# upper bounds of the duration histogram buckets, in seconds
+DURATION_BUCKETS = (.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class TaskMetrics(object):
+    """
+    Counters and duration histogram of a task's runs.
+    """
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.successes = 0
+        self.failures = 0
+        self.cooldown_seconds = 0.
+        self.last_success = None
+
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.duration_sum = 0.
+        self.duration_count = 0
+
+    def observe(self, started, ended, success):
+        if success:
+            self.successes += 1
+            self.last_success = time.time()
+        else:
+            self.failures += 1
+
+        duration = total_seconds(ended - started)
+        self.duration_sum += duration
+        self.duration_count += 1
+        for i, bound in enumerate(self.buckets):
+            if duration <= bound:
+                self.bucket_counts[i] += 1
+
+    def observe_cooldown(self, delta):
+        self.cooldown_seconds += total_seconds(delta)
+
+
+def exposition(tasks):
+    """
+    Return the metrics of tasks in Prometheus text format.
+    """
+    now = time.time()
+    lines = []
+
+    def metric(name, kind, help, samples):
+        lines.append('# HELP runner_%s %s' % (name, help))
+        lines.append('# TYPE runner_%s %s' % (name, kind))
+        for suffix, labels, value in samples:
+            labels = ','.join(['%s="%s"' % (k, str(v).replace('"', '\\"'))
+                               for k, v in labels])
+            lines.append('runner_%s%s{%s} %r' % (name, suffix, labels,
+                                                 value))
+
+    metric('task_runs_total', 'counter', 'Task runs by result.',
+        [('', [('task', t.path), ('result', 'success')], t.metrics.successes)
+            for t in tasks] +
+        [('', [('task', t.path), ('result', 'failure')], t.metrics.failures)
+            for t in tasks])
+
+    samples = []
+    for t in tasks:
+        m = t.metrics
+        for bound, count in zip(m.buckets, m.bucket_counts):
+            samples.append(('_bucket', [('task', t.path), ('le', bound)],
+                            count))
+        samples.append(('_bucket', [('task', t.path), ('le', '+Inf')],
+                        m.duration_count))
+        samples.append(('_sum', [('task', t.path)], m.duration_sum))
+        samples.append(('_count', [('task', t.path)], m.duration_count))
+    metric('task_duration_seconds', 'histogram', 'Task run durations.',
+           samples)
+
+    metric('task_cooldown_seconds_total', 'counter',
+        'Time tasks were scheduled to wait between runs.',
+        [('', [('task', t.path)], t.metrics.cooldown_seconds)
+            for t in tasks])
+
+    metric('task_seconds_since_last_success', 'gauge',
+        'Time since the last successful run, absent if none yet.',
+        [('', [('task', t.path)], now - t.metrics.last_success)
+            for t in tasks if t.metrics.last_success is not None])
+
+    return '\n'.join(lines) + '\n'
+
+
+def write(path, tasks):
+    """
+    Atomically write the metrics of tasks to path, for example for the
+    node_exporter textfile collector.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               prefix='.metrics')
+    try:
+        os.write(fd, exposition(tasks))
+    finally:
+        os.close(fd)
+    os.chmod(tmp, 0644)
+    os.rename(tmp, path)
+
+
+def serve(port, tasks, address='127.0.0.1'):
+    """
+    Serve the metrics of the tasks returned by callable tasks over HTTP from
+    a daemon thread.
+    """
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = exposition(tasks())
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='runner-metrics')
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,14 @@
+from django.db import models
+
+
+class TaskLease(models.Model):
+    """
+    A task, or node heartbeat, leased by a runner node until expires.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    owner = models.CharField(max_length=255, db_index=True)
+    expires = models.DateTimeField(db_index=True)
+
+    def __unicode__(self):
+        return u'%s leased by %s until %s' % (self.name, self.owner,
+                                              self.expires)
@@ -0,0 +1,194 @@
+import atexit
+import logging
+import threading
+import time
+import Queue
+
+from django.conf import settings
+from django.core import mail
+
+logger = logging.getLogger('runner')
+
+_notifier = None
+
+
+def get_notifier():
+    """
+    Return the process wide Notifier, configured by settings
+    RUNNER_NOTIFY_WINDOW, RUNNER_NOTIFY_RETRY_DELAY and
+    RUNNER_NOTIFY_MAX_RETRIES.
+    """
+    global _notifier
+    if _notifier is None:
+        _notifier = Notifier(
+            window=getattr(settings, 'RUNNER_NOTIFY_WINDOW', 10),
+            retry_delay=getattr(settings, 'RUNNER_NOTIFY_RETRY_DELAY', 60),
+            max_retries=getattr(settings, 'RUNNER_NOTIFY_MAX_RETRIES', 10))
+    return _notifier
+
+
+class Notifier(object):
+    """
+    Send admin notifications from a background thread, so that a slow or
+    broken mail server never blocks tasks.
+
+    Notifications queued within `window` seconds are sent as one digest,
+    over a mail connection which is kept open, and reopened if the server
+    closed it meanwhile. A failed send is retried every `retry_delay` seconds,
+    up to `max_retries` times.
+    """
+    def __init__(self, window=10, retry_delay=60, max_retries=10,
+                 from_email='critical@yourlabs.org'):
+        self.window = window
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.from_email = from_email
+
+        self.queue = Queue.Queue()
+        # notifications waiting for the end of the digest window
+        self.pending = []
+        self.connection = None
+        self.thread = None
+        self.lock = threading.Lock()
+        # serializes uses of the connection by the thread and flush()
+        self.send_lock = threading.Lock()
+
+    def notify(self, subject, body):
+        self.queue.put((subject, body))
+        self.start()
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+
+            self.thread = threading.Thread(target=self.loop,
+                                           name='runner-notifier')
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Send what is pending and stop the thread, before the interpreter
+        tears down the modules it uses.
+        """
+        with self.lock:
+            thread = self.thread
+        if thread is not None and thread.is_alive():
+            # sentinel
+            self.queue.put(None)
+            thread.join(30)
+        self.flush()
+
+    def loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            self.add_pending(item)
+
+            stopping = False
+            deadline = time.time() + self.window
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except Queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                self.add_pending(item)
+
+            if stopping:
+                self.send(self.pop_pending(), 0)
+                return
+            self.send(self.pop_pending(), self.max_retries)
+
+    def add_pending(self, item):
+        with self.lock:
+            self.pending.append(item)
+
+    def pop_pending(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        return batch
+
+    def flush(self):
+        """
+        Synchronously send whatever is queued or pending, trying once.
+        """
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not None:
+                self.add_pending(item)
+
+        self.send(self.pop_pending(), 0)
+
+    def digest(self, batch):
+        if len(batch) == 1:
+            subject, body = batch[0]
+        else:
+            subject = '%s admin notifications' % len(batch)
+            body = []
+            for item_subject, item_body in batch:
+                body += [item_subject, '=' * len(item_subject), '',
+                         item_body, '', '']
+            body = '\n'.join(body)
+
+        return mail.EmailMessage(subject, body, self.from_email,
+                                 [x[1] for x in settings.ADMINS])
+
+    def send(self, batch, retries):
+        if not batch:
+            return True
+
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay)
+
+            try:
+                self.deliver(self.digest(batch))
+                return True
+            except Exception:
+                logger.exception('Could not send %s admin notifications, '
+                                 'attempt %s', len(batch), attempt + 1)
+                self.close()
+
+        logger.error('Dropped %s admin notifications: %s', len(batch),
+                     ', '.join([subject for subject, body in batch]))
+        return False
+
+    def deliver(self, message):
+        """
+        Send message over the kept connection, or over a new one if there is
+        none or the server closed it after its idle timeout.
+        """
+        with self.send_lock:
+            if self.connection is not None:
+                try:
+                    self.connection.send_messages([message])
+                    return
+                except Exception:
+                    logger.debug('Mail connection lost, reconnecting')
+                    self.close()
+
+            self.connection = mail.get_connection()
+            self.connection.open()
+            self.connection.send_messages([message])
+
+    def close(self):
+        if self.connection is None:
+            return
+
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+        self.connection = None
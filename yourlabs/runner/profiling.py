@@ -0,0 +1,106 @@
+import cProfile
+import datetime
+import os
+import os.path
+import pstats
+import time
+
+from django.conf import settings
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+class Profiler(object):
+    """
+    Profiles runs of a task with cProfile, and tracemalloc if available.
+
+    With option profile_every, one run in profile_every is profiled. With
+    option profile_slower_than, each run is profiled and kept if it took at
+    least that many seconds.
+
+    Each kept profile is written to LOG_ROOT/profiles/<task name>/ as a .prof
+    file for pstats or snakeviz, and a .txt summary of the slowest functions
+    and top allocations. Only the last profile_keep profiles are kept.
+    """
+    def __init__(self, task, directory=None):
+        self.task = task
+        self.every = task.options['profile_every']
+        self.slower_than = task.options['profile_slower_than']
+        self.keep = task.options['profile_keep']
+        self._directory = directory
+        self.runs = 0
+
+    @property
+    def directory(self):
+        # the loader sets the path of the task after creating it
+        return self._directory or os.path.join(settings.LOG_ROOT, 'profiles',
+                                               self.task.path)
+
+    def call(self):
+        self.runs += 1
+        sampled = self.every and self.runs % self.every == 0
+        if not sampled and not self.slower_than:
+            return self.task.call()
+
+        profile = cProfile.Profile()
+        # tracemalloc is process wide, another thread may be tracing
+        trace = tracemalloc is not None and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+
+        started = time.time()
+        profile.enable()
+        try:
+            self.task.call()
+        finally:
+            profile.disable()
+            duration = time.time() - started
+
+            snapshot = None
+            if trace:
+                snapshot = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+
+            if sampled or duration >= self.slower_than:
+                self.save(profile, snapshot, duration)
+
+    def save(self, profile, snapshot, duration):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        path = os.path.join(self.directory,
+            datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f'))
+        profile.dump_stats(path + '.prof')
+
+        with open(path + '.txt', 'w') as f:
+            f.write('Run of %s took %.3f seconds\n\n' % (self.task.name,
+                                                         duration))
+            stats = pstats.Stats(profile, stream=f)
+            stats.sort_stats('cumulative').print_stats(20)
+
+            if snapshot is not None:
+                f.write('Top allocations:\n\n')
+                for stat in snapshot.statistics('lineno')[:20]:
+                    f.write('%s\n' % stat)
+
+        self.task.log('info', 'Profiled a run of %.3f seconds in %s.prof',
+                      duration, path)
+        self.clean()
+
+    def clean(self):
+        """
+        Delete all but the last keep profiles.
+        """
+        names = sorted(name[:-len('.prof')]
+                       for name in os.listdir(self.directory)
+                       if name.endswith('.prof'))
+
+        for name in names[:-self.keep]:
+            for extension in ('.prof', '.txt'):
+                try:
+                    os.unlink(os.path.join(self.directory, name + extension))
+                except OSError:
+                    pass
@@ -0,0 +1,116 @@
+import datetime
+import heapq
+import itertools
+import threading
+
+
+def total_seconds(delta):
+    """
+    Return the number of seconds in a timedelta, including days and
+    microseconds, unlike timedelta.seconds.
+    """
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+class Scheduler(object):
+    """
+    Heap of [next_run, counter, task] entries.
+
+    pop() sleeps until the nearest deadline only, so any number of tasks
+    costs one timer. schedule() and wake() may be called from any thread and
+    wake up a pending pop() if the new deadline is nearer.
+
+    A task has one entry at most: rescheduling it marks its previous entry as
+    removed, and pop() skips removed entries.
+    """
+    def __init__(self):
+        self.heap = []
+        # task -> its entry in the heap
+        self.entries = {}
+        # tasks woken up while they were not scheduled, ie. running
+        self.woken = set()
+        self.counter = itertools.count()
+        # reentrant, so that stop() and wake() work from a signal handler
+        self.condition = threading.Condition(threading.RLock())
+        self.stopped = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def schedule(self, task, when=None):
+        now = datetime.datetime.now()
+        if when is None:
+            when = now
+
+        with self.condition:
+            if task in self.woken:
+                self.woken.discard(task)
+                when = min(when, now)
+
+            previous = self.entries.pop(task, None)
+            if previous is not None:
+                previous[2] = None
+
+            # the counter breaks ties so that tasks are never compared
+            entry = [when, next(self.counter), task]
+            self.entries[task] = entry
+            heapq.heappush(self.heap, entry)
+            self.condition.notify()
+
+    def wake(self, task):
+        """
+        Make task due now, or as soon as it is scheduled again if it is
+        running. Any number of wakes before it runs make one run.
+        """
+        with self.condition:
+            entry = self.entries.get(task)
+            if entry is None:
+                self.woken.add(task)
+            elif entry[0] > datetime.datetime.now():
+                self.schedule(task)
+
+    def next_run(self):
+        """
+        Return the nearest deadline, None if nothing is scheduled.
+        """
+        with self.condition:
+            while self.heap and self.heap[0][2] is None:
+                heapq.heappop(self.heap)
+            if self.heap:
+                return self.heap[0][0]
+
+    def stop(self):
+        """
+        Make pending and further pop() calls return None.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def pop(self):
+        """
+        Block until the task with the nearest deadline is due and return it,
+        or None once stopped.
+        """
+        with self.condition:
+            while True:
+                if self.stopped:
+                    return None
+
+                if self.heap and self.heap[0][2] is None:
+                    heapq.heappop(self.heap)
+                    continue
+
+                if not self.heap:
+                    # an untimed wait can't be interrupted on python 2, and
+                    # signal handlers, like the drain one, would never run
+                    self.condition.wait(1)
+                    continue
+
+                delay = total_seconds(
+                    self.heap[0][0] - datetime.datetime.now())
+                if delay <= 0:
+                    task = heapq.heappop(self.heap)[2]
+                    del self.entries[task]
+                    return task
+                self.condition.wait(delay)
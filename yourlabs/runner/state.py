@@ -0,0 +1,139 @@
+import datetime
+import json
+import os.path
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def dumps(data):
+    def default(obj):
+        if isinstance(obj, datetime.datetime):
+            return {'$datetime': obj.strftime(DATETIME_FORMAT)}
+        raise TypeError('%r is not JSON serializable' % obj)
+    return json.dumps(data, default=default)
+
+
+def loads(text):
+    def object_hook(obj):
+        if '$datetime' in obj:
+            return datetime.datetime.strptime(obj['$datetime'],
+                                              DATETIME_FORMAT)
+        return obj
+    return json.loads(text, object_hook=object_hook)
+
+
+def get_backend():
+    """
+    Return an instance of the backend class which dotted path is in
+    settings.RUNNER_STATE_BACKEND, SQLiteBackend by default.
+    """
+    path = getattr(settings, 'RUNNER_STATE_BACKEND',
+                   'yourlabs.runner.state.SQLiteBackend')
+    module, name = path.rsplit('.', 1)
+    return getattr(import_module(module), name)()
+
+
+class StateBackend(object):
+    """
+    Stores the state of tasks across runner restarts.
+
+    A task state is a dict of JSON serializable values and datetimes. The
+    exception records of a task are stored apart, so that saving after a run
+    only writes the records which changed and deletes the forgotten ones.
+    """
+    def load(self, name, max_records):
+        """
+        Return (state, records) for task name, state is None if unknown and
+        records are the dicts of the max_records most recently seen ones.
+        """
+        raise NotImplementedError()
+
+    def save(self, name, state, records, forgotten):
+        raise NotImplementedError()
+
+
+class MemoryBackend(StateBackend):
+    """
+    Keeps nothing across restarts.
+    """
+    def load(self, name, max_records):
+        return None, []
+
+    def save(self, name, state, records, forgotten):
+        pass
+
+
+class SQLiteBackend(StateBackend):
+    """
+    Stores task states in a SQLite database, RUN_ROOT/runner.sqlite by
+    default, in WAL mode so that a write is a cheap append.
+    """
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(settings.RUN_ROOT, 'runner.sqlite')
+        self.path = path
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False,
+                                          isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS runner_task (
+                name TEXT PRIMARY KEY,
+                state TEXT NOT NULL
+            )
+        ''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS runner_exception (
+                task TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                record TEXT NOT NULL,
+                PRIMARY KEY (task, fingerprint)
+            )
+        ''')
+
+    def load(self, name, max_records):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT state FROM runner_task WHERE name = ?',
+                (name,)).fetchone()
+            rows = self.connection.execute(
+                'SELECT record FROM runner_exception WHERE task = ? '
+                'ORDER BY last_seen DESC LIMIT ?',
+                (name, max_records)).fetchall()
+
+        state = loads(row[0]) if row else None
+        return state, [loads(r[0]) for r in reversed(rows)]
+
+    def save(self, name, state, records, forgotten):
+        with self.lock:
+            self.connection.execute('BEGIN')
+            try:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO runner_task VALUES (?, ?)',
+                    (name, dumps(state)))
+
+                for record in records:
+                    self.connection.execute(
+                        'INSERT OR REPLACE INTO runner_exception '
+                        'VALUES (?, ?, ?, ?)',
+                        (name, record['fingerprint'],
+                         record['last_seen'].strftime(DATETIME_FORMAT),
+                         dumps(record)))
+
+                for fingerprint in forgotten:
+                    self.connection.execute(
+                        'DELETE FROM runner_exception WHERE task = ? '
+                        'AND fingerprint = ?', (name, fingerprint))
+
+                self.connection.execute('COMMIT')
+            except:
+                self.connection.execute('ROLLBACK')
+                raise
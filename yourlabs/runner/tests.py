@@ -0,0 +1,40 @@
+import datetime
+import os.path
+import tempfile
+import threading
+
+from django.test import TestCase
+
+from yourlabs import runner
+from yourlabs.runner import lease, state
+
+runs = []
+
+
+@runner.task(success_cooldown=.1)
+def a():
+    runs.append('a')
+
+@runner.task(success_cooldown=.1)
+def b():
+    runs.append('b')
+
+@runner.task(depends=['yourlabs.runner.tests.a', 'yourlabs.runner.tests.b'])
+def sink():
+    runs.append('sink')
+
+
+class LeaseDependsTestCase(TestCase):
+    def test_dependencies_count_in_fair_share(self):
+        del runs[:]
+        r = runner.TaskRunner(['yourlabs.runner.tests.sink'],
+            pidfile=os.path.join(tempfile.mkdtemp(), 'sink'),
+            state_backend=state.MemoryBackend(),
+            leases=lease.LeaseManager(1, datetime.timedelta(minutes=1)))
+        threading.Timer(1, r.drain).start()
+        r.run()
+
+        self.assertEqual(r.leases.task_count, 3)
+        self.assertIn('a', runs)
+        self.assertIn('b', runs)
+        self.assertIn('sink', runs)
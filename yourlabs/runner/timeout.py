@@ -0,0 +1,31 @@
+import contextlib
+import signal
+import threading
+
+
+class TaskTimeout(Exception):
+    pass
+
+
+def can_alarm():
+    """
+    Signals are only delivered to the main thread.
+    """
+    return isinstance(threading.current_thread(), threading._MainThread)
+
+
+@contextlib.contextmanager
+def alarm(seconds):
+    """
+    Raise TaskTimeout in the block after seconds, from the main thread only.
+    """
+    def handler(signum, frame):
+        raise TaskTimeout('Timed out after %s seconds' % seconds)
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
@@ -0,0 +1,221 @@
+"""
+Triggers wake a task up as soon as something happens, instead of waiting
+for the end of its cooldown, for example::
+
+    from yourlabs.runner import triggers
+
+    @runner.task(success_cooldown=td(hours=1),
+                 triggers=[triggers.SocketTrigger()])
+    def send_mail():
+        call_command('send_mail')
+
+    # in the web process
+    triggers.relay_post_save(Message, 'send_mail')
+"""
+import errno
+import os
+import os.path
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.db.models.signals import post_save
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+def socket_path(name):
+    """
+    Return the path of the socket of task name, or name if it is a path.
+    """
+    if os.sep in name:
+        return name
+    return os.path.join(settings.RUN_ROOT, '%s.sock' % name)
+
+
+class Trigger(object):
+    """
+    Calls wake() when its event happens, from any thread.
+    """
+    def start(self, task, wake):
+        raise NotImplementedError()
+
+    def stop(self):
+        pass
+
+    def thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+class FileTrigger(Trigger):
+    """
+    Wake the task up when a file, or a file in a directory, is written,
+    created, moved or deleted.
+
+    Uses inotify if pyinotify is installed, otherwise polls the modification
+    times every interval seconds.
+    """
+    def __init__(self, path, interval=1):
+        self.path = path
+        self.interval = interval
+        self.notifier = None
+        self.stopped = threading.Event()
+
+    def __repr__(self):
+        return '<FileTrigger %s>' % self.path
+
+    def start(self, task, wake):
+        self.stopped.clear()
+
+        if pyinotify is None:
+            self.thread(lambda: self.poll(wake), 'runner-file-%s' % task.name)
+            return
+
+        manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.ThreadedNotifier(manager,
+                                                   lambda event: wake())
+        self.notifier.daemon = True
+        self.notifier.start()
+        manager.add_watch(self.path, pyinotify.IN_CLOSE_WRITE |
+            pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+            pyinotify.IN_MOVED_TO | pyinotify.IN_MOVED_FROM,
+            rec=True, auto_add=True)
+
+    def stop(self):
+        self.stopped.set()
+        if self.notifier is not None:
+            self.notifier.stop()
+            self.notifier = None
+
+    def signature(self):
+        paths = [self.path]
+        if os.path.isdir(self.path):
+            paths += [os.path.join(self.path, name)
+                      for name in sorted(os.listdir(self.path))]
+
+        signature = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            signature.append((path, stat.st_mtime, stat.st_size))
+        return signature
+
+    def poll(self, wake):
+        previous = self.signature()
+        while not self.stopped.wait(self.interval):
+            current = self.signature()
+            if current != previous:
+                previous = current
+                wake()
+
+
+class SignalTrigger(Trigger):
+    """
+    Wake the task up when the runner receives signal signum. SIGUSR1 and
+    SIGTERM are taken to drain the runner, SIGUSR2 or SIGHUP are free.
+    """
+    def __init__(self, signum=signal.SIGUSR2):
+        self.signum = signum
+        self.previous = None
+
+    def __repr__(self):
+        return '<SignalTrigger %s>' % self.signum
+
+    def start(self, task, wake):
+        self.previous = signal.signal(self.signum,
+                                      lambda signum, frame: wake())
+
+    def stop(self):
+        if self.previous is not None:
+            signal.signal(self.signum, self.previous)
+            self.previous = None
+
+
+class SocketTrigger(Trigger):
+    """
+    Wake the task up when a datagram is received on a Unix socket, by
+    default RUN_ROOT/<task name>.sock. See send() and relay_post_save().
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.socket = None
+        self.bound = None
+
+    def __repr__(self):
+        return '<SocketTrigger %s>' % self.path
+
+    def unlink(self, path):
+        try:
+            os.unlink(path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def start(self, task, wake):
+        self.bound = socket_path(self.path or task.name)
+        self.unlink(self.bound)
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.bound)
+        self.thread(lambda: self.receive(self.socket, wake),
+                    'runner-socket-%s' % task.name)
+
+    def stop(self):
+        sock, self.socket = self.socket, None
+        if sock is not None:
+            try:
+                # unblocks recv() in the thread
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+            self.unlink(self.bound)
+
+    def receive(self, sock, wake):
+        while True:
+            try:
+                sock.recv(1024)
+            except socket.error:
+                return
+            if self.socket is not sock:
+                # stopped
+                return
+            wake()
+
+
+def send(name):
+    """
+    Wake up the task listening on the socket of task name, or on the socket
+    at path name. Does nothing if no runner listens.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        sock.sendto('wake', socket_path(name))
+    except socket.error:
+        # the runner isn't started, or is already awake
+        pass
+    finally:
+        sock.close()
+
+
+def relay_post_save(model, name):
+    """
+    Wake up the task listening on the socket of task name, or on the socket
+    at path name, each time an instance of model is saved.
+    """
+    def receiver(sender, **kwargs):
+        send(name)
+
+    post_save.connect(receiver, sender=model, weak=False,
+                      dispatch_uid='runner_relay_%s_%s' % (model.__name__,
+                                                           name))
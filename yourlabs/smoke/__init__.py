@@ -1,8 +1,17 @@
+import collections
+import datetime
 import sys
 import logging
+import multiprocessing
 import pickle
+import re
+import time
 import traceback
+import Queue
 
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
 from django.db.models import get_model
 from django.conf import settings
 from django.test import client
@@ -14,12 +23,130 @@ try:
 except ImportError:
     sentry_exception_handler = False
 
+try:
+    import tracemalloc
+except ImportError:
+    # python < 3.4 without the pytracemalloc backport
+    tracemalloc = None
+
 logger = logging.getLogger('smoke')
 
+# maximum number of urls in a query
+CHUNK_SIZE = 500
+
+# quoted strings, values compared to, which some backends don't quote in
+# the sql they log, and numbers
+LITERALS = re.compile(r"'(?:[^']|'')*'|(?<=[=<>] )[^\s,)]+|\b\d+\b")
+
+# FailUrl fields set by check(), sent back by worker processes
+RESULT_FIELDS = ('reason', 'duration', 'exception', 'traceback', 'queries',
+                 'db_time', 'duplicate_queries', 'memory_peak', 'memory_sites')
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
 class SmokeUrl(object):
-    def __init__(self, url, tags):
+    """
+    A url to check, with optional budgets: the url fails if it takes more
+    than max_queries queries, max_db_time seconds of queries, or, in memory
+    mode, a peak of max_memory bytes.
+    """
+    def __init__(self, url, tags, max_queries=None, max_db_time=None,
+                 max_memory=None):
         self.url = url
-        self.tags = tags
+        if isinstance(tags, basestring):
+            tags = [tags]
+        self.tags = list(tags or [])
+        self.max_queries = max_queries
+        self.max_db_time = max_db_time
+        self.max_memory = max_memory
+
+class QueryCapture(object):
+    """
+    Record the queries of the current thread in the block, even without
+    DEBUG, by forcing the debug cursor of its connections.
+
+    duplicates is the number of queries which repeat a previous one but for
+    literal values, as in N+1 queries. It is computed on access, so that the
+    normalization of the queries doesn't count in the duration of requests.
+    """
+    def __init__(self):
+        self.queries = []
+        self.count = None
+        self.time = None
+        self._statements = None
+
+    def __enter__(self):
+        self.saved = []
+        for connection in connections.all():
+            self.saved.append((connection, connection.use_debug_cursor,
+                               connection.queries))
+            connection.use_debug_cursor = True
+            connection.queries = []
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        for connection, use_debug_cursor, queries in self.saved:
+            # the request replaced the list, see reset_queries
+            self.queries += connection.queries
+            connection.use_debug_cursor = use_debug_cursor
+            connection.queries = queries
+
+        self.count = len(self.queries)
+        self.time = sum(float(query['time']) for query in self.queries)
+
+    @property
+    def statements(self):
+        if self._statements is None:
+            self._statements = collections.Counter(
+                LITERALS.sub('?', query['sql']) for query in self.queries)
+        return self._statements
+
+    @property
+    def duplicates(self):
+        if self.count is None:
+            return None
+        return sum(n - 1 for n in self.statements.values())
+
+    def most_duplicated(self, n=3):
+        return [(sql, count) for sql, count in self.statements.most_common(n)
+                if count > 1]
+
+class MemoryCapture(object):
+    """
+    Record the peak of memory allocated in the block, and the top lines
+    which allocated the memory still held at the end of the block, with
+    tracemalloc.
+
+    tracemalloc traces all the threads, so other threads must be idle.
+    """
+    def __init__(self, top=10):
+        self.top = top
+        self.peak = None
+        self.sites = None
+
+    def __enter__(self):
+        self.started = not tracemalloc.is_tracing()
+        if self.started:
+            tracemalloc.start()
+        # also resets the peak
+        tracemalloc.clear_traces()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ])
+        if self.started:
+            tracemalloc.stop()
+
+        self.sites = ['%s:%s: %.1f KiB in %s blocks' % (
+                          stat.traceback[0].filename,
+                          stat.traceback[0].lineno,
+                          stat.size / 1024., stat.count)
+                      for stat in snapshot.statistics('lineno')[:self.top]]
 
 class Smoke(object):
     def get_client(self):
@@ -27,37 +154,293 @@ class Smoke(object):
         c.login(username=settings.SMOKE_TEST_USERNAME, password=settings.SMOKE_TEST_PASSWORD)
         return c
 
-    def run(self):
+    def check(self, c, smoke_url, memory=False):
+        """
+        Fetch smoke_url with client c, return an unsaved FailUrl with the
+        duration of the request, and the reason of the failure if any.
+
+        With memory, also record the peak of memory allocated by the request
+        and the top allocation sites, see MemoryCapture.
+        """
+        FailUrl = get_model('smoke', 'failurl')
+        failurl = FailUrl(url=smoke_url.url)
+        capture = QueryCapture()
+        memory_capture = None
+        if memory:
+            memory_capture = MemoryCapture(
+                getattr(settings, 'SMOKE_MEMORY_TOP', 10))
+
+        try:
+            started = time.time()
+            with capture:
+                if memory_capture is not None:
+                    with memory_capture:
+                        response = c.get(smoke_url.url)
+                else:
+                    response = c.get(smoke_url.url)
+            failurl.duration = time.time() - started
+            if response.status_code != 200:
+                logger.error('status code %s from %s' % (response.status_code, smoke_url.url))
+                failurl.reason = 'status code %s' % response.status_code
+                return failurl
+        except Exception as e:
+            if sentry_exception_handler:
+                sentry_exception_handler(request=None)
+
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            print ''.join(traceback.format_exception(
+                            exc_type, exc_value, exc_tb))
+            logger.error('exception %s in %s' % (e, smoke_url.url))
+            failurl.traceback = pickle.dumps(traceback.format_exception(
+                            exc_type, exc_value, exc_tb))
+            failurl.exception = unicode(e)
+            failurl.reason = 'exception'
+            return failurl
+        finally:
+            failurl.queries = capture.count
+            failurl.db_time = capture.time
+            failurl.duplicate_queries = capture.duplicates
+            if memory_capture is not None:
+                failurl.memory_peak = memory_capture.peak
+                if memory_capture.sites is not None:
+                    failurl.memory_sites = '\n'.join(memory_capture.sites)
+
+        if smoke_url.max_queries is not None and \
+                capture.count > smoke_url.max_queries:
+            logger.error('%s queries in %s, budget is %s, most duplicated: %s'
+                         % (capture.count, smoke_url.url,
+                            smoke_url.max_queries, capture.most_duplicated()))
+            failurl.reason = 'queries'
+        elif smoke_url.max_db_time is not None and \
+                capture.time > smoke_url.max_db_time:
+            logger.error('%.3fs of queries in %s, budget is %.3fs' % (
+                         capture.time, smoke_url.url, smoke_url.max_db_time))
+            failurl.reason = 'db time'
+        elif memory_capture is not None and \
+                smoke_url.max_memory is not None and \
+                memory_capture.peak > smoke_url.max_memory:
+            logger.error('%s bytes allocated in %s, budget is %s, top: %s' % (
+                         memory_capture.peak, smoke_url.url,
+                         smoke_url.max_memory, memory_capture.sites[:3]))
+            failurl.reason = 'memory'
+
+        # should be ok
+        return failurl
+
+    def check_all(self, smoke_urls, workers):
+        """
+        Check smoke_urls in workers processes, each with its own logged in
+        client and database connections: the test client is not thread safe.
+        Return the results in the order of smoke_urls.
+        """
         FailUrl = get_model('smoke', 'failurl')
-        c = self.get_client()
+        todo = multiprocessing.Queue()
+        done = multiprocessing.Queue()
+        for i, smoke_url in enumerate(smoke_urls):
+            todo.put((i, smoke_url))
+
+        processes = []
+        for i in range(min(workers, len(smoke_urls))):
+            todo.put(None)
+            process = multiprocessing.Process(target=self.serve,
+                args=(todo, done), name='smoke-%s' % i)
+            process.daemon = True
+            process.start()
+            processes.append(process)
 
-        for smoke_url in self.get_urls():
-            FailUrl.objects.filter(url=smoke_url.url).delete()
-            failurl = FailUrl(url=smoke_url.url)
+        results = [None] * len(smoke_urls)
+        try:
+            for n in range(len(smoke_urls)):
+                i, values, error = self.receive(done, processes)
+                if error is not None:
+                    # unchecked urls would pass for ok
+                    raise RuntimeError('Smoke worker failed:\n%s' % error)
+                results[i] = FailUrl(url=smoke_urls[i].url,
+                                     **dict(zip(RESULT_FIELDS, values)))
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+        return results
 
+    def receive(self, done, processes):
+        """
+        Return the next (index, values, error) tuple sent by a worker
+        process, raise RuntimeError if they all exited without sending it.
+        """
+        while True:
             try:
-                response = c.get(smoke_url.url)
-                if response.status_code != 200:
-                    logger.error('status code %s from %s' % (response.status_code, smoke_url.url))
-                    failurl.reason = 'status code %s' % response.status_code
-                    failurl.save()
-                    failurl.tags.add(smoke_url.tags)
-                    continue
-            except Exception as e:
-                if sentry_exception_handler:
-                    sentry_exception_handler(request=response.request)
-
-                exc_type, exc_value, exc_tb = sys.exc_info()
-                print ''.join(traceback.format_exception(
-                                exc_type, exc_value, exc_tb))
-                logger.error('exception %s in %s' % (e, smoke_url.url))
-                failurl.traceback = pickle.dumps(traceback.format_exception(
-                                exc_type, exc_value, exc_tb))
-                failurl.exception = unicode(e)
-                failurl.reason = 'exception'
-                failurl.save()
-                failurl.tags.add(smoke_url.tags)
+                return done.get(timeout=1)
+            except Queue.Empty:
+                pass
+
+            if any(p.exitcode not in (None, 0) for p in processes):
+                raise RuntimeError('Smoke worker died')
+            if not any(p.is_alive() for p in processes):
+                try:
+                    # sent right before the last worker exited
+                    return done.get(timeout=1)
+                except Queue.Empty:
+                    raise RuntimeError('Smoke workers exited early')
+
+    def serve(self, todo, done):
+        """
+        Worker process loop: check the urls of todo and put plain tuples of
+        their results in done.
+        """
+        for connection in connections.all():
+            # don't close the parent's socket, just forget it
+            connection.connection = None
+
+        try:
+            c = self.get_client()
+            while True:
+                item = todo.get()
+                if item is None:
+                    return
+                i, smoke_url = item
+                failurl = self.check(c, smoke_url)
+                done.put((i, [getattr(failurl, field)
+                              for field in RESULT_FIELDS], None))
+        except Exception:
+            done.put((None, None, traceback.format_exc()))
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+    def get_stats(self, smoke_urls):
+        """
+        Return a dict of url: UrlStat for smoke_urls, with new UrlStats for
+        urls which were never checked.
+        """
+        UrlStat = get_model('smoke', 'urlstat')
+
+        stats = {}
+        for urls in chunks([s.url for s in smoke_urls], CHUNK_SIZE):
+            for stat in UrlStat.objects.filter(url__in=urls):
+                stats[stat.url] = stat
+
+        for smoke_url in smoke_urls:
+            if smoke_url.url not in stats:
+                stats[smoke_url.url] = UrlStat(url=smoke_url.url)
+        return stats
+
+    def compare(self, results, stats, latency=True):
+        """
+        Fail results which took more than settings.SMOKE_SLOW_RATIO (default:
+        3) times the median duration of their url, if they took at least
+        settings.SMOKE_SLOW_MIN_DURATION seconds (default: .1) and the url
+        has at least settings.SMOKE_MIN_SAMPLES durations (default: 5).
+        Then add the durations of the results which succeeded to their url's
+        samples.
+
+        Without latency, for durations skewed by memory measures, only record
+        the queries and memory of the results.
+        """
+        ratio = getattr(settings, 'SMOKE_SLOW_RATIO', 3)
+        min_duration = getattr(settings, 'SMOKE_SLOW_MIN_DURATION', .1)
+        min_samples = getattr(settings, 'SMOKE_MIN_SAMPLES', 5)
+        size = getattr(settings, 'SMOKE_SAMPLES', 20)
+
+        for result in results:
+            if result.reason is not None or result.duration is None:
                 continue
-            
-            # should be ok
-            FailUrl.objects.filter(url=smoke_url.url).delete()
+
+            stat = stats[result.url]
+            if latency:
+                baseline = stat.get_baseline()
+                if baseline is not None and \
+                        len(stat.get_samples()) >= min_samples and \
+                        result.duration >= min_duration and \
+                        result.duration > baseline * ratio:
+                    logger.error('%s took %.3fs, usually %.3fs' % (
+                                 result.url, result.duration, baseline))
+                    result.reason = 'slow'
+
+                stat.add_sample(result.duration, size)
+            stat.queries = result.queries
+            stat.db_time = result.db_time
+            stat.duplicate_queries = result.duplicate_queries
+            if result.memory_peak is not None:
+                stat.memory_peak = result.memory_peak
+                stat.memory_sites = result.memory_sites
+
+    def save(self, smoke_urls, results, stats=None):
+        """
+        Replace the FailUrls of smoke_urls with the failed results, and the
+        UrlStats of smoke_urls with stats if any, in one transaction and a
+        number of queries which doesn't depend on the number of urls but on
+        the number of distinct tags.
+        """
+        FailUrl = get_model('smoke', 'failurl')
+        UrlStat = get_model('smoke', 'urlstat')
+        TaggedItem = FailUrl.tags.through
+        Tag = TaggedItem.tag_model()
+
+        failed = [(smoke_url, failurl) for smoke_url, failurl
+                  in zip(smoke_urls, results) if failurl.reason is not None]
+
+        with transaction.commit_on_success():
+            for urls in chunks([s.url for s in smoke_urls], CHUNK_SIZE):
+                FailUrl.objects.filter(url__in=urls).delete()
+                if stats is not None:
+                    UrlStat.objects.filter(url__in=urls).delete()
+
+            if stats is not None:
+                now = datetime.datetime.now()
+                for stat in stats.values():
+                    stat.pk = None
+                    stat.update_datetime = now
+                UrlStat.objects.bulk_create(stats.values())
+
+            FailUrl.objects.bulk_create([f for s, f in failed])
+
+            # bulk_create doesn't set primary keys
+            ids = {}
+            for urls in chunks([s.url for s, f in failed], CHUNK_SIZE):
+                for pk, url in FailUrl.objects.filter(url__in=urls
+                        ).order_by('pk').values_list('pk', 'url'):
+                    ids.setdefault(url, []).append(pk)
+
+            names = set()
+            for smoke_url, failurl in failed:
+                names.update(smoke_url.tags)
+            tags = dict((tag.name, tag) for tag in
+                        Tag.objects.filter(name__in=names))
+            for name in names - set(tags):
+                tags[name] = Tag.objects.create(name=name)
+
+            content_type = ContentType.objects.get_for_model(FailUrl)
+            items = []
+            for smoke_url, failurl in failed:
+                pk = ids[smoke_url.url].pop(0)
+                for name in set(smoke_url.tags):
+                    items.append(TaggedItem(tag=tags[name], object_id=pk,
+                                            content_type=content_type))
+            TaggedItem.objects.bulk_create(items)
+
+    def run(self, workers=1, memory=False):
+        """
+        Check the urls, in workers processes, or in the current process with
+        memory, which measures the memory of each url with tracemalloc.
+        """
+        if memory and tracemalloc is None:
+            raise ImproperlyConfigured('tracemalloc is required to measure '
+                                       'memory')
+
+        smoke_urls = list(self.get_urls())
+
+        if workers > 1 and not memory:
+            results = self.check_all(smoke_urls, workers)
+        else:
+            # tracemalloc can't tell threads apart
+            c = self.get_client()
+            results = [self.check(c, smoke_url, memory)
+                       for smoke_url in smoke_urls]
+
+        stats = self.get_stats(smoke_urls)
+        # tracemalloc slows requests down
+        self.compare(results, stats, latency=not memory)
+        self.save(smoke_urls, results, stats)
+        return results
@@ -3,7 +3,14 @@ from django.contrib import admin
 from models import *
 
 class FailUrlAdmin(admin.ModelAdmin):
-    list_display = ('url', 'creation_datetime')
-    list_filter = ('creation_datetime',)
+    list_display = ('url', 'creation_datetime', 'reason', 'duration',
+                    'queries', 'db_time', 'memory_peak')
+    list_filter = ('creation_datetime', 'reason')
 
 admin.site.register(FailUrl, FailUrlAdmin)
+
+class UrlStatAdmin(admin.ModelAdmin):
+    list_display = ('url', 'update_datetime', 'queries', 'db_time',
+                    'duplicate_queries', 'memory_peak')
+
+admin.site.register(UrlStat, UrlStatAdmin)
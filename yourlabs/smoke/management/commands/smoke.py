@@ -1,20 +1,34 @@
+from optparse import make_option
+
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.utils.importlib import import_module
 from django.utils.module_loading import module_has_submodule
 
 import smoke
+from yourlabs.smoke import tracemalloc
 
 class Command(BaseCommand):
     args = 'n/a'
     help = 'gsm smoke test'
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=1,
+            help='Number of urls to fetch concurrently'),
+        make_option('--memory', action='store_true', dest='memory',
+            default=False, help='Measure the memory of each url with '
+            'tracemalloc, one url at a time'),
+    )
 
     def handle(self, *args, **options):
+        if options['memory'] and tracemalloc is None:
+            raise CommandError('--memory requires tracemalloc')
+
         for app in settings.INSTALLED_APPS:
             app_module = import_module(app)
             try:
                 module = import_module('%s.smoke' % app)
-                module.Smoke().run()
+                module.Smoke().run(workers=options['workers'],
+                                   memory=options['memory'])
             except:
                 if module_has_submodule(app_module, 'smoke'):
                     raise
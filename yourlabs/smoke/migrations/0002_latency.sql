@@ -0,0 +1,9 @@
+ALTER TABLE "smoke_failurl" ADD COLUMN "duration" double precision NULL;
+
+CREATE TABLE "smoke_urlstat" (
+    "id" serial NOT NULL PRIMARY KEY,
+    "url" varchar(200) NOT NULL UNIQUE,
+    "update_datetime" timestamp with time zone NOT NULL,
+    "samples" text NOT NULL
+)
+;
@@ -0,0 +1,7 @@
+ALTER TABLE "smoke_failurl" ADD COLUMN "queries" integer NULL;
+ALTER TABLE "smoke_failurl" ADD COLUMN "db_time" double precision NULL;
+ALTER TABLE "smoke_failurl" ADD COLUMN "duplicate_queries" integer NULL;
+
+ALTER TABLE "smoke_urlstat" ADD COLUMN "queries" integer NULL;
+ALTER TABLE "smoke_urlstat" ADD COLUMN "db_time" double precision NULL;
+ALTER TABLE "smoke_urlstat" ADD COLUMN "duplicate_queries" integer NULL;
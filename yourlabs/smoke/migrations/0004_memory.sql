@@ -0,0 +1,5 @@
+ALTER TABLE "smoke_failurl" ADD COLUMN "memory_peak" bigint NULL;
+ALTER TABLE "smoke_failurl" ADD COLUMN "memory_sites" text NULL;
+
+ALTER TABLE "smoke_urlstat" ADD COLUMN "memory_peak" bigint NULL;
+ALTER TABLE "smoke_urlstat" ADD COLUMN "memory_sites" text NULL;
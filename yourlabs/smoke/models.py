@@ -1,3 +1,4 @@
+import json
 import traceback
 
 from django.db.models import Q
@@ -22,8 +23,48 @@ class FailUrl(models.Model):
     response = models.TextField(null=True, blank=True)
     reason = models.TextField(null=True, blank=True)
     traceback = models.TextField(null=True, blank=True)
+    # seconds
+    duration = models.FloatField(null=True, blank=True)
+    queries = models.IntegerField(null=True, blank=True)
+    db_time = models.FloatField(null=True, blank=True)
+    duplicate_queries = models.IntegerField(null=True, blank=True)
+    # bytes, in memory mode
+    memory_peak = models.BigIntegerField(null=True, blank=True)
+    # top allocation sites, one per line
+    memory_sites = models.TextField(null=True, blank=True)
 
     tags = TaggableManager()
 
     class Meta:
         ordering = ['creation_datetime']
+
+class UrlStat(models.Model):
+    url = models.URLField(unique=True)
+    update_datetime = models.DateTimeField(auto_now=True)
+    # json list of the durations of the last checks, in seconds
+    samples = models.TextField(default='[]')
+    # of the last successful check
+    queries = models.IntegerField(null=True, blank=True)
+    db_time = models.FloatField(null=True, blank=True)
+    duplicate_queries = models.IntegerField(null=True, blank=True)
+    # of the last successful check in memory mode
+    memory_peak = models.BigIntegerField(null=True, blank=True)
+    memory_sites = models.TextField(null=True, blank=True)
+
+    def get_samples(self):
+        return json.loads(self.samples)
+
+    def add_sample(self, duration, size):
+        self.samples = json.dumps((self.get_samples() + [duration])[-size:])
+
+    def get_baseline(self):
+        """
+        Return the median of the samples, None if there are none.
+        """
+        samples = sorted(self.get_samples())
+        if not samples:
+            return None
+        middle = len(samples) / 2
+        if len(samples) % 2:
+            return samples[middle]
+        return (samples[middle - 1] + samples[middle]) / 2.
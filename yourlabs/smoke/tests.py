@@ -0,0 +1,49 @@
+from django.conf.urls import patterns, url
+from django.http import HttpResponse
+from django.test import TestCase, client
+
+from yourlabs.smoke import Smoke, SmokeUrl
+
+
+def ok(request, n):
+    return HttpResponse(n)
+
+def boom(request, n):
+    raise ValueError('boom %s' % n)
+
+urlpatterns = patterns('',
+    url(r'^ok/(\d+)/$', ok),
+    url(r'^boom/(\d+)/$', boom),
+)
+
+
+class TestSmoke(Smoke):
+    def get_client(self):
+        # no user to log in
+        return client.Client()
+
+    def get_urls(self):
+        urls = []
+        for n in range(20):
+            urls.append(SmokeUrl('/ok/%s/' % n, 'ok'))
+            urls.append(SmokeUrl('/boom/%s/' % n, 'boom'))
+        return urls
+
+
+class CheckAllTestCase(TestCase):
+    urls = 'yourlabs.smoke.tests'
+
+    def test_results_match_urls(self):
+        smoke = TestSmoke()
+        smoke_urls = smoke.get_urls()
+        results = smoke.check_all(smoke_urls, 8)
+
+        self.assertEqual([r.url for r in results],
+                         [s.url for s in smoke_urls])
+        for result in results:
+            n = result.url.split('/')[2]
+            if result.url.startswith('/ok/'):
+                self.assertEqual(result.reason, None, result.exception)
+            else:
+                self.assertEqual(result.reason, 'exception')
+                self.assertEqual(result.exception, 'boom %s' % n)